@@ -1,15 +1,63 @@
 from tinydb import TinyDB, Query
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
 import pandas as pd
+import atexit
 import os
+import threading
+from historyCache import history_cache
+from frameUtil import key_dtypes
 
 class TinyDBManager:
-    def __init__(self, db_path="tinydb.json"):
-        """Initialize TinyDB and create metadata table if not exists."""
-        self.db = TinyDB(db_path)
+    def __init__(self, db_path="tinydb.json", storage=JSONStorage, write_cache_size=1000):
+        """
+        Initialize TinyDB and create metadata table if not exists.
+
+        The storage is wrapped in a write cache: reads are served from memory and the
+        underlying file is only rewritten every `write_cache_size` writes, on flush()
+        or on close() (also registered at interpreter exit).
+
+        :param db_path: Database file passed to the storage.
+        :param storage: TinyDB storage class (JSONStorage by default, MemoryStorage for tests...).
+        :param write_cache_size: Writes buffered before the storage is flushed automatically.
+        """
+        self.db_path = db_path
+        self.storage = CachingMiddleware(storage)
+        self.storage.WRITE_CACHE_SIZE = write_cache_size
+        self.db = TinyDB(db_path, storage=self.storage)
         self.metadata_table = self.db.table("metadata")
+        self._closed = False
+        # system_name -> {key tuple -> [doc_id, ...]} over the system's registered key_columns
+        self._key_indexes = {}
+        # TinyDB is not thread-safe: API reads and background loads share this lock
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    def flush(self):
+        """Write all cached changes to the underlying storage."""
+        with self._lock:
+            if not self._closed:
+                self.storage.flush()
+
+    def close(self):
+        """Flush cached changes and close the storage."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self.db.close()
+
+    def register_system(self, system_name, key_columns, criteria_columns, flush=False):
+        """
+        Register a system in metadata. Table name is derived from system_name.
 
-    def register_system(self, system_name, key_columns, criteria_columns):
-        """Register a system in metadata. Table name is derived from system_name."""
+        :param flush: Persist the registration to storage immediately.
+        """
+        with self._lock:
+            self._register_system(system_name, key_columns, criteria_columns)
+        if flush:
+            self.flush()
+
+    def _register_system(self, system_name, key_columns, criteria_columns):
         table_name = f"{system_name}_data"
         query = Query()
 
@@ -21,6 +69,8 @@ class TinyDBManager:
                 "key_columns": key_columns,
                 "criteria_columns": criteria_columns
             })
+            self._key_indexes.pop(system_name, None)
+            history_cache.invalidate_system(self._cache_name(system_name))
             print(f"✅ Registered system: {system_name}, Table: {table_name}")
         else:
             print(f"⚠️ System '{system_name}' already registered.")
@@ -30,35 +80,129 @@ class TinyDBManager:
         table_name = f"{system_name}_data"
         return self.db.table(table_name)
 
-    def load_csv_to_system(self, system_name, csv_path):
-        """Load CSV data into the corresponding system table."""
+    def load_csv_to_system(self, system_name, csv_path, flush=False, chunk_size=None, progress=None):
+        """
+        Load CSV data into the corresponding system table.
+
+        :param flush: Persist the data to storage immediately.
+        :param chunk_size: Read and insert the CSV this many rows at a time (None reads it at once);
+                           the lock is released between chunks so reads are not blocked for the whole load.
+        :param progress: Optional callable, called with the row count of each inserted chunk.
+        :return: Number of records loaded (None if the file is missing).
+        """
         if not os.path.exists(csv_path):
             print("❌ CSV file not found!")
             return
-        
+
+        # Key columns are read as text so identifiers like "00000" keep their leading zeros
+        dtype = key_dtypes(self.get_key_columns(system_name))
+        chunks = pd.read_csv(csv_path, chunksize=chunk_size, dtype=dtype) if chunk_size else [pd.read_csv(csv_path, dtype=dtype)]
+        loaded = 0
+        for df in chunks:
+            records = df.to_dict(orient="records")
+            with self._lock:
+                self._insert_records(system_name, records)
+            loaded += len(records)
+            if progress:
+                progress(len(records))
+        if flush:
+            self.flush()
+
+        print(f"✅ Loaded {loaded} records into {system_name}_data")
+        return loaded
+
+    def _insert_records(self, system_name, records):
+        """Insert records into a system table, keeping its key index and cached lookups current."""
         table = self.create_system_table(system_name)
-        df = pd.read_csv(csv_path)
-        records = df.to_dict(orient="records")
-        table.insert_multiple(records)
+        doc_ids = table.insert_multiple(records)
+        index = self._key_indexes.get(system_name)
+        key_columns = self.get_key_columns(system_name)
+        if index is not None:
+            for doc_id, record in zip(doc_ids, records):
+                index.setdefault(_index_key(record, key_columns), []).append(doc_id)
+        if key_columns:
+            history_cache.invalidate(
+                self._cache_name(system_name), {_index_key(record, key_columns) for record in records}
+            )
+        else:
+            history_cache.invalidate_system(self._cache_name(system_name))
 
-        print(f"✅ Loaded {len(records)} records into {system_name}_data")
+    def get_key_columns(self, system_name):
+        """Return the registered key_columns of a system (empty list if it is not registered)."""
+        query = Query()
+        metadata = self.metadata_table.get(query.system_name == system_name)
+        return list(metadata["key_columns"]) if metadata else []
 
     def get_historical_data(self, system_name, filters={}):
-        """Retrieve historical data for a given system based on filters."""
+        """
+        Retrieve historical data for a given system based on filters.
+
+        When the filters cover all of the system's registered key_columns, the documents
+        are found through an in-memory hash index (built on first use, maintained by
+        load_csv_to_system) and only the remaining filters are checked on them.
+        Other filters fall back to a full table scan.
+
+        Pure key lookups are served from the shared history_cache when possible.
+        """
+        with self._lock:
+            return self._get_historical_data(system_name, filters)
+
+    def _get_historical_data(self, system_name, filters):
         table_name = f"{system_name}_data"
         table = self.db.table(table_name)
         query = Query()
 
-        print(table_name)
-        print(table)
-        print(filters)
+        key_columns = self.get_key_columns(system_name)
+        if filters and key_columns and all(col in filters for col in key_columns):
+            key = _index_key(filters, key_columns)
+            residual = {col: value for col, value in filters.items() if col not in key_columns}
+            if not residual:
+                hit, cached = history_cache.get(self._cache_name(system_name), key)
+                if hit:
+                    return cached
+
+            index = self._key_index(system_name, table, key_columns)
+            documents = (table.get(doc_id=doc_id) for doc_id in index.get(key, ()))
+            results = [
+                doc for doc in documents
+                if doc is not None and all(doc.get(col) == value for col, value in residual.items())
+            ]
+            if not residual:
+                history_cache.put(self._cache_name(system_name), key, results)
+            return results
 
         if filters:
-            results = table.search(query.fragment(filters))
+            # Key columns are stored as text: compare them as text so 1111 matches "1111"
+            condition = query.noop()
+            for col, value in filters.items():
+                if col in key_columns:
+                    condition &= Query()[col].test(lambda stored, expected: str(stored) == expected, str(value))
+                else:
+                    condition &= Query()[col] == value
+            results = table.search(condition)
         else:
             results = table.all()
 
         return results
 
+    def _cache_name(self, system_name):
+        """Namespace of a system of this database in the shared history_cache."""
+        return f"tinydb:{os.path.abspath(self.db_path)}:{system_name}"
+
+    def _key_index(self, system_name, table, key_columns):
+        """Return the system's key index, building it from the table on first use."""
+        index = self._key_indexes.get(system_name)
+        if index is None:
+            index = {}
+            for doc in table:
+                index.setdefault(_index_key(doc, key_columns), []).append(doc.doc_id)
+            self._key_indexes[system_name] = index
+        return index
+
+
+def _index_key(record, key_columns):
+    """Hashable key of a record over key_columns (as text, so 1111 and "1111" match)."""
+    return tuple(str(record.get(col)) for col in key_columns)
+
 # 🌟 Initialize DB on startup
 db_manager = TinyDBManager()
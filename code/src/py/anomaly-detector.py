@@ -1,23 +1,24 @@
 import json
-from openai import OpenAI
+from collections import deque
 import pandas as pd
-from sqlUtil import SQLiteDB
-
-#Initialize the in-memory database
-db = SQLiteDB()
+from sqlUtil import SQLiteDB, history_key
+from historyStore import open_history_store
+from historyCache import history_cache
+from llmClient import LLMClient
 
 # 1️⃣ Load Configuration
 with open("anomaly_config.json", "r") as config_file:
     config = json.load(config_file)
 
-# Load historical data from a CSV file
-db.load_csv_data(config["historical_data_file"])
+# Open the history store (persistent when history_db_path is set) and append any new history
+db = SQLiteDB(config.get("history_db_path", ":memory:"), retention_months=config.get("history_retention_months"))
+history_store = open_history_store(config, db)
+history_cache.resize(config.get("history_cache_size", history_cache.maxsize))
+history_store.load_csv_incremental(config["historical_data_file"])
 
 
-client = OpenAI(
-  base_url=config["base_url"],
-  api_key=config["api_key"]
-)
+# Shared LLM client: concurrent requests within the configured concurrency, RPM/TPM limits and timeouts
+llm = LLMClient.from_config(config)
 
 def load_new_data_from_csv(csv_path):
     df = pd.read_csv(csv_path)
@@ -30,7 +31,7 @@ def find_anomalies():
     print(new_data[0])
 
     # Query the historical database
-    historical_data = db.get_historical_data(new_data[0])
+    historical_data = history_store.get_historical_data(new_data[0])
     if historical_data:
         print("🔍 Matching historical records found:")
         print(historical_data)
@@ -43,11 +44,7 @@ def find_anomalies():
             new_data=json.dumps(new_data, indent=2)
         )
 
-    completion = client.chat.completions.create(
-    extra_headers={
-
-    },
-    extra_body={},
+    completion = llm.complete(
     model=config["llm_model"],
     messages=[
             {"role": "system", "content": "You are a financial anomaly detection assistant."},
@@ -76,4 +73,124 @@ def find_anomalies():
     
     return predictions
 
+
+def estimate_tokens(text):
+    """Rough token count of a prompt (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def build_batch_prompt(items):
+    """
+    Prompt for several records at once; each item is (id, record, history summary).
+    """
+    records = [{"id": item_id, "record": record, "history": summary} for item_id, record, summary in items]
+    return config["batch_prompt_template"].format(
+        count=len(items),
+        records=json.dumps(records, default=str),
+        categories="\n".join(f"- {category}" for category in config["anomaly_categories"])
+    )
+
+
+def next_batch(pending, summaries):
+    """
+    Take up to llm_batch_size items from the front of the queue, fewer if the prompt plus
+    llm_tokens_per_result per answer would not fit in llm_context_tokens.
+    """
+    batch = []
+    while pending and len(batch) < config.get("llm_batch_size", 10):
+        item_id, record = pending[0]
+        candidate = batch + [(item_id, record, summaries.get(history_key(record)))]
+        needed = (estimate_tokens(build_batch_prompt(candidate))
+                  + config.get("llm_tokens_per_result", 80) * len(candidate))
+        if batch and needed > config.get("llm_context_tokens", 8192):
+            break
+        batch = candidate
+        pending.popleft()
+    return batch
+
+
+def parse_batch_response(content, batch):
+    """
+    Parse the JSON array answer of a batch prompt.
+
+    :return: Tuple (results, failed): results maps item id -> (anomaly, category, explanation)
+             for every valid item; failed lists the ids that were missing or invalid.
+    """
+    expected = {item_id for item_id, _, _ in batch}
+    results = {}
+    try:
+        items = json.loads(content[content.index("["):content.rindex("]") + 1])
+    except ValueError:
+        items = []
+    for item in items if isinstance(items, list) else []:
+        # Ids are the batch's integer positions: reject lists/dicts (unhashable) and 1.0 / true (equal to ints)
+        if not isinstance(item, dict) or type(item.get("id")) is not int or item["id"] not in expected:
+            continue
+        anomaly = str(item.get("anomaly", "")).strip().capitalize()
+        category = str(item.get("category", "")).strip()
+        if anomaly not in ("Yes", "No") or category not in config["anomaly_categories"]:
+            continue
+        results[item["id"]] = (anomaly, category, str(item.get("explanation", "")).strip())
+    return results, sorted(expected - set(results))
+
+
+def find_anomalies_batched(new_data=None):
+    """
+    Score many records with few LLM calls: records are packed llm_batch_size at a time
+    (bounded by llm_context_tokens), each with its own history summary, and the model
+    answers with one JSON result per record. The batches are sent concurrently through
+    the shared LLM client. Invalid or missing results are re-queued and retried up to
+    llm_max_attempts times.
+
+    :param new_data: List of new records (defaults to the configured new_data_case1 file).
+    :return: Tuple (number of records scored, list of records that could not be scored).
+    """
+    if new_data is None:
+        new_data = load_new_data_from_csv(config["new_data_case1"])
+    summaries = history_store.get_history_stats_bulk(new_data)
+    pending = deque(enumerate(new_data))
+    attempts = {item_id: 0 for item_id in range(len(new_data))}
+    scored, calls, unscored = 0, 0, []
+
+    with db.prediction_writer() as writer:
+        while pending:
+            # Every batch of a round is sent at once; failed items go to the next round
+            batches = []
+            while pending:
+                batches.append(next_batch(pending, summaries))
+            calls += len(batches)
+            completions = llm.complete_many(
+                {
+                    "model": config["llm_model"],
+                    "messages": [
+                        {"role": "system", "content": "You are a financial anomaly detection assistant."},
+                        {"role": "user", "content": build_batch_prompt(batch)}
+                    ],
+                    "max_tokens": config.get("llm_tokens_per_result", 80) * len(batch)
+                }
+                for batch in batches
+            )
+
+            for batch, completion in zip(batches, completions):
+                if isinstance(completion, Exception):
+                    print(f"⚠️ LLM call failed for {len(batch)} records: {completion}")
+                    results, failed = {}, [item_id for item_id, _, _ in batch]
+                else:
+                    results, failed = parse_batch_response(completion.choices[0].message.content or "", batch)
+
+                for item_id, (anomaly, category, explanation) in results.items():
+                    writer.write(new_data[item_id], anomaly, category, explanation)
+                    scored += 1
+                for item_id in failed:
+                    attempts[item_id] += 1
+                    if attempts[item_id] < config.get("llm_max_attempts", 3):
+                        pending.append((item_id, new_data[item_id]))
+                    else:
+                        unscored.append(new_data[item_id])
+
+    print(f"✅ Scored {scored}/{len(new_data)} records with {calls} LLM calls.")
+    if unscored:
+        print(f"❌ {len(unscored)} records could not be scored after {config.get('llm_max_attempts', 3)} attempts.")
+    return scored, unscored
+
 db.close()
\ No newline at end of file
@@ -1,12 +1,43 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 import pandas as pd
 import os
 import queue
+import uuid
+from jobUtil import JobManager, count_csv_rows
+from frameUtil import key_dtypes, read_history_csv
+from queueUtil import MicroBatchConsumer
+from responseUtil import json_response, dataframe_response, init_app, table_format
+from scoringUtil import score_frame, split_columns
+from systemRegistry import SystemRegistry
 
 app = Flask(__name__)
-
-# In-memory storage for reconciliation systems
-reconciliation_systems = {}
+# Compress large responses (brotli/gzip per Accept-Encoding)
+init_app(app)
+
+# Reconciliation systems: definitions and frames on disk, shared by all worker processes,
+# with a bounded per-process working set of frames
+SYSTEM_REGISTRY_DIR = "system_registry"
+SYSTEM_CACHE_BYTES = 512 * 1024 * 1024
+reconciliation_systems = SystemRegistry(SYSTEM_REGISTRY_DIR, max_cache_bytes=SYSTEM_CACHE_BYTES)
+
+# Uploaded prediction files are spooled here until their job has scored them
+PREDICTION_SPOOL_DIR = "prediction_spool"
+PREDICTION_CHUNK_SIZE = 50000
+PREDICTION_WORKERS = min(4, os.cpu_count() or 1)
+# Status and scored rows are kept in the registry for this many most recent jobs
+PREDICTION_RESULTS_RETAINED = 20
+
+# Live prediction queue: capacity (pushes beyond it get 429), consumer threads and micro-batch triggers
+PREDICTION_QUEUE_SIZE = 10000
+PREDICTION_QUEUE_CONSUMERS = 2
+PREDICTION_QUEUE_BATCH_SIZE = 500
+PREDICTION_QUEUE_BATCH_WAIT_MS = 200
+
+# Background prediction jobs; their status and scored chunks are persisted in the registry,
+# so a poll can be answered by any worker process
+prediction_jobs = JobManager(
+    max_workers=PREDICTION_WORKERS, on_change=lambda job: reconciliation_systems.save_prediction_job(job.status())
+)
 
 
 # Load systems from CSV (mock initial data loader)
@@ -17,31 +48,50 @@ def load_system_data():
         {"name": "System B", "key_columns": "Currency,AU", "criteria_columns": "Balance Difference"}
     ]
     for system in systems:
-        reconciliation_systems[system["name"]] = {
-            "info": {
-                "key_columns": system["key_columns"],
-                "criteria_columns": system["criteria_columns"],
-            },
-            "history": pd.DataFrame(),
-            "predictions": pd.DataFrame()
-        }
+        if system["name"] not in reconciliation_systems:
+            reconciliation_systems.register(system["name"], system["key_columns"], system["criteria_columns"])
 
 
 load_system_data()
 
 
+def run_prediction_job(job, system_name, file_path):
+    """
+    Background job: score a spooled prediction file chunk by chunk against the system's history.
+    Each scored chunk is stored in the registry before the job's progress is reported.
+    """
+    partial = []
+    try:
+        info = reconciliation_systems.info(system_name)
+        key_columns, criteria_columns = info["key_columns"], info["criteria_columns"]
+        job.set_total(count_csv_rows(file_path))
+        profile = reconciliation_systems.get_profile(system_name)
+        for chunk in pd.read_csv(file_path, chunksize=PREDICTION_CHUNK_SIZE, dtype=key_dtypes(key_columns)):
+            scored = score_frame(chunk, profile, key_columns, criteria_columns)
+            reconciliation_systems.append_prediction_chunk(job.job_id, job.rows, scored)
+            partial.append(scored)
+            job.progress(len(chunk))
+    finally:
+        os.remove(file_path)
+
+    predictions = pd.concat(partial, ignore_index=True) if partial else pd.DataFrame()
+    reconciliation_systems.put_predictions(system_name, predictions)
+    counts = predictions["Anomaly"].value_counts() if len(predictions) else {}
+    return {"anomalies": int(counts.get("Yes", 0)), "review": int(counts.get("Review", 0))}
+
+
 # API: Get all reconciliation systems
 @app.route('/api/get-reconciliation-systems', methods=['GET'])
 def get_reconciliation_systems():
     systems = [
         {
-            "name": name,
-            "keyColumns": system["info"]["key_columns"],
-            "criteriaColumns": system["info"]["criteria_columns"]
+            "name": system["name"],
+            "keyColumns": ",".join(system["key_columns"]),
+            "criteriaColumns": ",".join(system["criteria_columns"])
         }
-        for name, system in reconciliation_systems.items()
+        for system in reconciliation_systems.list_systems()
     ]
-    return jsonify(systems)
+    return json_response(systems)
 
 
 # API: Add new reconciliation system
@@ -53,77 +103,132 @@ def add_reconciliation_system():
     file = request.files.get('historicalFile')
 
     if not name or not key_columns or not criteria_columns or not file:
-        return jsonify({"error": "Missing fields"}), 400
+        return json_response({"error": "Missing fields"}, 400)
 
     # Load historical data from the uploaded file
     try:
-        historical_data = pd.read_csv(file)
-        reconciliation_systems[name] = {
-            "info": {
-                "key_columns": key_columns,
-                "criteria_columns": criteria_columns,
-            },
-            "history": historical_data,
-            "predictions": pd.DataFrame()
-        }
+        historical_data = read_history_csv(file, split_columns(key_columns), split_columns(criteria_columns))
+        reconciliation_systems.register(name, key_columns, criteria_columns)
+        reconciliation_systems.put_history(name, historical_data)
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return json_response({"error": str(e)}, 400)
 
-    return jsonify({"message": "Reconciliation system added successfully"}), 201
+    return json_response({"message": "Reconciliation system added successfully"}, 201)
 
 
-# API: Upload history data
+# API: Upload history data.
+# mode=replace (default) swaps the whole history; mode=append / mode=upsert merge a delta file
+# keyed on the system's key columns plus the as-of date (optional dateColumn).
 @app.route('/api/upload-history', methods=['POST'])
 def upload_history():
     system_name = request.form.get('system_name')
     file = request.files.get('historyFile')
+    mode = request.form.get('mode', 'replace')
 
     if not system_name or system_name not in reconciliation_systems or not file:
-        return jsonify({"error": "Invalid system or file"}), 400
+        return json_response({"error": "Invalid system or file"}, 400)
+    if mode not in ("replace", "append", "upsert"):
+        return json_response({"error": f"Invalid mode '{mode}'"}, 400)
 
     try:
-        history_data = pd.read_csv(file)
-        reconciliation_systems[system_name]["history"] = history_data
+        info = reconciliation_systems.info(system_name)
+        history_data = read_history_csv(
+            file, info["key_columns"], info["criteria_columns"], request.form.get('dateColumn')
+        )
+        if mode == "replace":
+            reconciliation_systems.put_history(system_name, history_data, request.form.get('dateColumn'))
+            summary = {"history_rows": len(history_data)}
+        else:
+            summary = reconciliation_systems.merge_history(
+                system_name, history_data, mode, request.form.get('dateColumn')
+            )
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return json_response({"error": str(e)}, 400)
 
-    return jsonify({"message": "History uploaded successfully"}), 200
+    return json_response({"message": "History uploaded successfully", **summary})
 
 
-# API: Upload file for anomaly prediction
+# API: Upload file for anomaly prediction (scored in the background, returns a job id)
 @app.route('/api/upload-and-predict', methods=['POST'])
 def upload_and_predict():
     system_name = request.form.get('system_name')
     file = request.files.get('predictionFile')
 
     if not system_name or system_name not in reconciliation_systems or not file:
-        return jsonify({"error": "Invalid system or file"}), 400
+        return json_response({"error": "Invalid system or file"}, 400)
 
     try:
-        prediction_data = pd.read_csv(file)
-        # Mock prediction process
-        prediction_data["Anomaly"] = ["Yes" if x % 2 == 0 else "No" for x in range(len(prediction_data))]
-        reconciliation_systems[system_name]["predictions"] = prediction_data
+        os.makedirs(PREDICTION_SPOOL_DIR, exist_ok=True)
+        file_path = os.path.join(PREDICTION_SPOOL_DIR, f"{uuid.uuid4().hex}.csv")
+        file.save(file_path)
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return json_response({"error": str(e)}, 400)
 
-    return jsonify({"message": "Prediction file uploaded and processed successfully"}), 200
+    job = prediction_jobs.submit(
+        "prediction", run_prediction_job, system_name, file_path,
+        system_name=system_name, file_name=file.filename
+    )
+    reconciliation_systems.evict_prediction_jobs(PREDICTION_RESULTS_RETAINED)
+    return json_response({"message": "Prediction job queued", "job_id": job.job_id}, 202)
 
 
-# API: Get prediction results
+# API: Get prediction results (JSON by default, ?format=csv|arrow or Accept header for tabular output).
+# With job_id: the job's progress and the rows scored so far, from the optional row offset.
 @app.route('/api/get-prediction-results', methods=['GET'])
 def get_prediction_results():
     system_name = request.args.get('system_name')
+    job_id = request.args.get('job_id')
 
     if not system_name or system_name not in reconciliation_systems:
-        return jsonify({"error": "Invalid system"}), 400
-
-    prediction_data = reconciliation_systems[system_name]["predictions"]
-    return prediction_data.to_json(orient="records")
-
-
-# In-memory queue for predictions
-prediction_queue = queue.Queue()
+        return json_response({"error": "Invalid system"}, 400)
+
+    if not job_id:
+        prediction_data = reconciliation_systems.get_predictions(system_name)
+        return dataframe_response(prediction_data)
+
+    # Served from the registry: the job may be running in another worker process
+    status = reconciliation_systems.prediction_job(job_id)
+    if status is None or status.get("system_name") != system_name:
+        return json_response({"error": "Unknown job"}, 404)
+    prediction_data = reconciliation_systems.prediction_job_results(
+        job_id, max(request.args.get('offset', 0, type=int), 0)
+    )
+
+    if table_format() == "json":
+        return dataframe_response(prediction_data, "json", envelope=status, key="predictions")
+    response = dataframe_response(prediction_data)
+    response.headers["X-Job-Status"] = status["status"]
+    response.headers["X-Rows-Processed"] = str(status["rows_processed"])
+    return response
+
+
+def score_live_records(records):
+    """
+    Consumer handler: score a micro-batch of pushed records, grouped by their system_name,
+    and persist the results in the registry (see /api/queue-results).
+    """
+    by_system = {}
+    for record in records:
+        by_system.setdefault(record.get("system_name"), []).append(record)
+    for system_name, group in by_system.items():
+        frame = pd.DataFrame(group)
+        if system_name not in reconciliation_systems:
+            scored = frame.assign(**{"Anomaly": "Review", "Anomaly Score": None, "Anomaly Reason": "Unknown system"})
+        else:
+            info = reconciliation_systems.info(system_name)
+            try:
+                scored = score_frame(frame, reconciliation_systems.get_profile(system_name),
+                                     info["key_columns"], info["criteria_columns"])
+            except ValueError as e:
+                scored = frame.assign(**{"Anomaly": "Review", "Anomaly Score": None, "Anomaly Reason": str(e)})
+        reconciliation_systems.append_live_results(system_name, scored)
+
+# In-memory queue for predictions, drained in micro-batches by a consumer pool
+prediction_consumer = MicroBatchConsumer(
+    score_live_records, maxsize=PREDICTION_QUEUE_SIZE, workers=PREDICTION_QUEUE_CONSUMERS,
+    batch_size=PREDICTION_QUEUE_BATCH_SIZE, max_wait_ms=PREDICTION_QUEUE_BATCH_WAIT_MS, name="prediction-queue"
+)
+prediction_queue = prediction_consumer.queue
 
 # Mock data for systems
 mock_transactions_a1 = [
@@ -140,49 +245,69 @@ mock_transactions_a2 = [
 # API: Get transactions from System A1
 @app.route('/api/system-a1/transactions', methods=['GET'])
 def get_transactions_a1():
-    return jsonify(mock_transactions_a1)
+    return json_response(mock_transactions_a1)
 
 
 # API: Get transactions from System A2
 @app.route('/api/system-a2/transactions', methods=['GET'])
 def get_transactions_a2():
-    return jsonify(mock_transactions_a2)
+    return json_response(mock_transactions_a2)
 
 
-# API: Push data to the prediction queue
+# API: Push data to the prediction queue (one JSON object with at least system_name)
 @app.route('/api/push-to-queue', methods=['POST'])
 def push_to_queue():
-    data = request.json
-    prediction_queue.put(data)
-    return jsonify({"message": "Data pushed to prediction queue", "data": data})
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get("system_name"):
+        return json_response({"error": "Expected a JSON object with a system_name"}, 400)
+    try:
+        prediction_consumer.put(data)
+    except queue.Full:
+        response = json_response({"error": "Prediction queue is full, retry later"}, 429)
+        response.headers["Retry-After"] = "1"
+        return response
+    return json_response({"message": "Data pushed to prediction queue", "data": data})
+
+
+# API: Prediction queue depth, lag and throughput
+@app.route('/api/queue-metrics', methods=['GET'])
+def queue_metrics():
+    return json_response(prediction_consumer.metrics())
+
+
+# API: Most recent results scored from the prediction queue, newest last
+@app.route('/api/queue-results', methods=['GET'])
+def queue_results():
+    limit = request.args.get('limit', 100, type=int)
+    return json_response(reconciliation_systems.live_results(limit) if limit > 0 else [])
 
 
 # API: Update System A1
 @app.route('/api/system-a1/update', methods=['POST'])
 def update_system_a1():
     data = request.json
-    return jsonify({"message": "System A1 updated successfully", "data": data})
+    return json_response({"message": "System A1 updated successfully", "data": data})
 
 
 # API: Update System A2
 @app.route('/api/system-a2/update', methods=['POST'])
 def update_system_a2():
     data = request.json
-    return jsonify({"message": "System A2 updated successfully", "data": data})
+    return json_response({"message": "System A2 updated successfully", "data": data})
 
 
 # API: Mimic ticket creation
 @app.route('/api/create-ticket', methods=['POST'])
 def create_ticket():
     data = request.json
-    return jsonify({"message": "Ticket created successfully", "ticket": data})
+    return json_response({"message": "Ticket created successfully", "ticket": data})
 
 
 # API: Mimic sending notification email
 @app.route('/api/send-email', methods=['POST'])
 def send_email():
     data = request.json
-    return jsonify({"message": "Notification email sent successfully", "email_details": data})
+    return json_response({"message": "Notification email sent successfully", "email_details": data})
 
 
 # Run the Flask app
@@ -0,0 +1,106 @@
+import pandas as pd
+from sqlUtil import DATE_FORMATS, HISTORY_CSV_HEADERS
+
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+
+def key_dtypes(key_columns):
+    """read_csv dtypes that keep key columns as text (so "00000" is not read as 0)."""
+    return {col: str for col in key_columns}
+
+
+def find_date_column(columns):
+    """The as-of date column among a frame's columns (matched like history CSV headers), or None."""
+    lookup = {str(col).strip().lower(): col for col in columns}
+    return next((lookup[alias.lower()] for alias in HISTORY_CSV_HEADERS["as_of_date"] if alias.lower() in lookup), None)
+
+
+def compact_numeric(series):
+    """
+    Smallest lossless numeric dtype for a column: downcast integers when every value is
+    integral, otherwise float32 when it round-trips exactly, else float64.
+    """
+    if pd.api.types.is_string_dtype(series):
+        series = series.str.replace(",", "", regex=False)
+    values = pd.to_numeric(series, errors="coerce")
+    if values.notna().all() and (values % 1 == 0).all():
+        return pd.to_numeric(values.astype("int64"), downcast="integer")
+    as_float32 = values.astype("float32")
+    if ((as_float32.astype("float64") == values) | values.isna()).all():
+        return as_float32
+    return values.astype("float64")
+
+
+def parse_dates(series):
+    """Parse a date column with the first of DATE_FORMATS that fits every value (mixed formats otherwise)."""
+    values = series.dropna().astype(str)
+    for date_format in DATE_FORMATS:
+        parsed = pd.to_datetime(values, format=date_format, errors="coerce")
+        if parsed.notna().all():
+            return pd.to_datetime(series, format=date_format)
+    return pd.to_datetime(series, format="mixed", errors="coerce")
+
+
+def optimise_frame(df, key_columns=(), numeric_columns=(), date_column=None):
+    """
+    Apply compact dtypes to a history frame in place of pandas' defaults.
+
+    - key columns: text categoricals when low-cardinality (integer codes for groupbys), else text
+    - numeric columns (balances): compact_numeric
+    - date column: datetime64
+    - other text columns with few distinct values: categoricals
+
+    :return: The converted frame (a new object; the input is not modified).
+    """
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if col in key_columns:
+            series = series.astype(str).where(series.notna())
+            df[col] = series.astype("category") if _low_cardinality(series) else series
+        elif col in numeric_columns:
+            df[col] = compact_numeric(series)
+        elif col == date_column:
+            df[col] = parse_dates(series)
+        elif pd.api.types.is_string_dtype(series) and _low_cardinality(series):
+            df[col] = series.astype("category")
+    return df
+
+
+def read_history_csv(source, key_columns=(), numeric_columns=(), date_column=None):
+    """
+    Read a history CSV with system-aware dtypes (see optimise_frame).
+
+    Key columns are parsed as text so identifiers keep their leading zeros.
+
+    :param source: Path or file-like object.
+    :param key_columns: The system's key columns.
+    :param numeric_columns: Balance/criteria columns to store compactly.
+    :param date_column: As-of date column to parse (detected from the usual history headers if omitted).
+    :return: pandas DataFrame.
+    """
+    df = pd.read_csv(source, dtype=key_dtypes(key_columns))
+    return optimise_frame(df, key_columns, numeric_columns, date_column or find_date_column(df.columns))
+
+
+def concat_frames(frames):
+    """pd.concat that keeps categorical columns categorical, over the union of their categories."""
+    frames = list(frames)
+    categorical = {
+        col for frame in frames for col in frame.columns if isinstance(frame[col].dtype, pd.CategoricalDtype)
+    }
+    for col in categorical:
+        values = [
+            pd.Series(frame[col].cat.categories if isinstance(frame[col].dtype, pd.CategoricalDtype)
+                      else frame[col].dropna().unique())
+            for frame in frames if col in frame.columns
+        ]
+        dtype = pd.CategoricalDtype(pd.Index(pd.concat(values, ignore_index=True).unique()))
+        frames = [frame.assign(**{col: frame[col].astype(dtype)}) if col in frame.columns else frame
+                  for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _low_cardinality(series):
+    return len(series) > 0 and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series)
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+
+class HistoryCache:
+    """
+    Size-bounded LRU cache for historical-data lookups, shared by every history store.
+
+    Entries are keyed by (system, key tuple); a key can hold several variants of the
+    same lookup (e.g. different `months` windows), which are evicted and invalidated
+    together. Stores invalidate exactly the keys they load new history for.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, system, key, variant=None):
+        """
+        Look up a cached result.
+
+        :return: Tuple (hit, value); value is a fresh list so callers can't mutate the cache.
+        """
+        with self._lock:
+            variants = self._entries.get((system, key))
+            if variants is not None and variant in variants:
+                self._entries.move_to_end((system, key))
+                self.hits += 1
+                return True, list(variants[variant])
+            self.misses += 1
+            return False, None
+
+    def put(self, system, key, value, variant=None):
+        """Cache a lookup result, evicting the least recently used keys beyond maxsize."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries.setdefault((system, key), {})[variant] = list(value)
+            self._entries.move_to_end((system, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, system, keys):
+        """Drop the cached results of the given keys of a system."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop((system, key), None)
+
+    def invalidate_system(self, system):
+        """Drop every cached result of a system."""
+        with self._lock:
+            for entry in [entry for entry in self._entries if entry[0] == system]:
+                del self._entries[entry]
+
+    def resize(self, maxsize):
+        """Change the capacity, evicting least recently used keys if it shrinks."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss counters and occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+# 🌟 Shared by SQLiteDB and TinyDBManager lookups
+history_cache = HistoryCache()
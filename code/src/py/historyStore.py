@@ -0,0 +1,18 @@
+from sqlUtil import SQLiteDB
+
+
+def open_history_store(config, db: SQLiteDB):
+    """
+    Return the history backend selected by config["history_backend"].
+
+    "sqlite" (default) keeps history in the SQLiteDB that also holds predictions;
+    "parquet" reads key-sorted Parquet files under config["history_parquet_dir"].
+    Both expose load_csv_incremental, get_historical_data and get_historical_data_bulk.
+    """
+    backend = config.get("history_backend", "sqlite")
+    if backend == "sqlite":
+        return db
+    if backend == "parquet":
+        from parquetUtil import ParquetHistoryStore  # pyarrow is only needed for this backend
+        return ParquetHistoryStore(config.get("history_parquet_dir", "history_parquet"))
+    raise ValueError(f"Unknown history_backend '{backend}'")
@@ -0,0 +1,145 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def count_csv_rows(path):
+    """Number of data rows in a CSV file (line count minus the header), for job totals."""
+    with open(path, "rb") as file:
+        lines = sum(block.count(b"\n") for block in iter(lambda: file.read(1024 * 1024), b""))
+    return max(lines - 1, 0)
+
+
+class JobManager:
+    """
+    Runs long tasks (history ingestion, batch scoring...) on a small worker pool and
+    keeps their progress so API handlers can return a job id immediately.
+
+    A task is called as task(job, *args) and reports progress through job.progress(rows)
+    (and, when it knows it, the total through job.set_total(rows)).
+    """
+
+    def __init__(self, max_workers=1, on_change=None):
+        """
+        :param max_workers: Number of jobs run at a time.
+        :param on_change: Optional callable(job) run when a job is queued, starts, reports
+                          progress and finishes (e.g. to persist its status for other processes).
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._on_change = on_change
+
+    def submit(self, kind, task, *args, **details):
+        """
+        Queue a task.
+
+        :param kind: Short job type shown in the status (e.g. "ingestion").
+        :param task: Callable task(job, *args); its return value is stored as the job result.
+        :param details: Extra fields shown in the status (system name, file name...).
+        :return: The new Job.
+        """
+        job = Job(kind, details, self._on_change)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.changed()
+        self._executor.submit(job.run, task, *args)
+        return job
+
+    def get(self, job_id):
+        """Return a job by id (None if unknown)."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        """Status of every known job, newest first."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.status() for job in sorted(jobs, key=lambda job: job.created_at, reverse=True)]
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and (optionally) wait for the running ones."""
+        self._executor.shutdown(wait=wait)
+
+
+class Job:
+    """Progress and outcome of one background task."""
+
+    def __init__(self, kind, details=None, on_change=None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.details = details or {}
+        self.state = "queued"
+        self.rows = 0
+        self.total_rows = None
+        self.errors = []
+        self.result = None
+        self.created_at = datetime.now()
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+        self._on_change = on_change
+
+    def progress(self, rows):
+        """Record `rows` more rows processed."""
+        with self._lock:
+            self.rows += rows
+        self.changed()
+
+    def set_total(self, rows):
+        """Record the total number of rows the job will process."""
+        self.total_rows = rows
+        self.changed()
+
+    def changed(self):
+        """Notify the on_change callback; a failing callback is reported without failing the job."""
+        if self._on_change is None:
+            return
+        try:
+            self._on_change(self)
+        except Exception:
+            traceback.print_exc()
+
+    def error(self, message):
+        """Record a non-fatal error; the job keeps running."""
+        with self._lock:
+            self.errors.append(message)
+
+    def run(self, task, *args):
+        self._started = time.perf_counter()
+        self.state = "running"
+        self.changed()
+        try:
+            self.result = task(self, *args)
+            self.state = "completed"
+        except Exception as e:
+            traceback.print_exc()
+            self.error(str(e))
+            self.state = "failed"
+        finally:
+            self._finished = time.perf_counter()
+            self.changed()
+            print(f"{'✅' if self.state == 'completed' else '❌'} Job {self.job_id} ({self.kind}) {self.state}: {self.rows} rows")
+
+    def status(self):
+        """JSON-serialisable snapshot of the job."""
+        with self._lock:
+            elapsed = 0.0
+            if self._started is not None:
+                elapsed = (self._finished or time.perf_counter()) - self._started
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "status": self.state,
+                "rows_processed": self.rows,
+                "total_rows": self.total_rows,
+                "elapsed_seconds": round(elapsed, 3),
+                "rows_per_second": round(self.rows / elapsed) if elapsed > 0 else 0,
+                "errors": list(self.errors),
+                "result": self.result,
+                "created_at": self.created_at.isoformat(timespec="seconds"),
+                **self.details,
+            }
@@ -0,0 +1,188 @@
+import asyncio
+import random
+import threading
+import time
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
+
+# Defaults for the llm_* config keys read by LLMClient.from_config
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 20
+DEFAULT_TOKENS_PER_MINUTE = 100000
+DEFAULT_TIMEOUT_SECONDS = 60
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_SECONDS = 1.0
+DEFAULT_BACKOFF_MAX_SECONDS = 30.0
+
+# Event loop shared by all clients, run on a daemon thread so synchronous callers can use it
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-client-loop", daemon=True).start()
+        return _loop
+
+
+def estimate_tokens(messages, max_tokens=0):
+    """Rough token cost of a request: ~4 characters per prompt token plus the completion budget."""
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4 + 1 + (max_tokens or 0)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute, holding at most a
+    minute's worth. acquire(amount) waits until the amount is available.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # A request larger than the bucket would wait forever; let it through on a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class LLMClient:
+    """
+    Chat completion client that runs many requests concurrently.
+
+    Requests are limited by a concurrency cap and requests-per-minute / tokens-per-minute
+    token buckets, time out after timeout_seconds, and are retried with exponential backoff
+    (and jitter, honouring Retry-After) on 429, 5xx, timeouts and connection errors.
+
+    Synchronous code calls complete() / complete_many(); coroutines already running on the
+    client's loop can await acomplete().
+    """
+
+    def __init__(self, api_key, base_url=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS, backoff_max_seconds=DEFAULT_BACKOFF_MAX_SECONDS):
+        self.timeout = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff = backoff_seconds
+        self.backoff_max = backoff_max_seconds
+        self.loop = _event_loop()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "succeeded": 0, "failed": 0, "retries": 0, "timeouts": 0, "rate_limited": 0}
+
+        async def setup():
+            # Retries are handled here, so the SDK's own are disabled
+            self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout_seconds)
+            self.semaphore = asyncio.Semaphore(max_concurrency)
+            self.request_bucket = TokenBucket(requests_per_minute)
+            self.token_bucket = TokenBucket(tokens_per_minute)
+
+        asyncio.run_coroutine_threadsafe(setup(), self.loop).result()
+
+    @classmethod
+    def from_config(cls, config, api_key=None):
+        """
+        Client configured from anomaly_config.json (api_key, base_url and the llm_* limits).
+
+        :param api_key: Overrides config["api_key"] (e.g. for a second provider key).
+        """
+        return cls(
+            api_key=api_key if api_key is not None else config["api_key"],
+            base_url=config.get("base_url"),
+            max_concurrency=config.get("llm_max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            requests_per_minute=config.get("llm_requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE),
+            tokens_per_minute=config.get("llm_tokens_per_minute", DEFAULT_TOKENS_PER_MINUTE),
+            timeout_seconds=config.get("llm_timeout_seconds", DEFAULT_TIMEOUT_SECONDS),
+            max_retries=config.get("llm_max_retries", DEFAULT_MAX_RETRIES),
+            backoff_seconds=config.get("llm_backoff_seconds", DEFAULT_BACKOFF_SECONDS),
+            backoff_max_seconds=config.get("llm_backoff_max_seconds", DEFAULT_BACKOFF_MAX_SECONDS),
+        )
+
+    async def acomplete(self, **request):
+        """
+        One chat completion (same arguments as chat.completions.create), rate limited and retried.
+
+        :return: The completion object.
+        :raises: The last error once max_retries retries are exhausted, or any non-retryable error.
+        """
+        cost = estimate_tokens(request.get("messages", []), request.get("max_tokens"))
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire()
+            await self.token_bucket.acquire(cost)
+            self._count("requests")
+            try:
+                async with self.semaphore:
+                    completion = await asyncio.wait_for(
+                        self.client.chat.completions.create(**request), self.timeout
+                    )
+                self._count("succeeded")
+                return completion
+            except (asyncio.TimeoutError, APITimeoutError, APIConnectionError, APIStatusError) as e:
+                retry_after = self._retry_after(e, attempt)
+                if retry_after is None or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(retry_after)
+
+    def _retry_after(self, error, attempt):
+        """Seconds to wait before retrying after `error`, or None when it is not retryable."""
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError)):
+            self._count("timeouts")
+        elif isinstance(error, APIStatusError):
+            if error.status_code != 429 and error.status_code < 500:
+                return None
+            if error.status_code == 429:
+                self._count("rate_limited")
+                header = error.response.headers.get("retry-after")
+                try:
+                    return min(float(header), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        return min(self.backoff * 2 ** min(attempt, 16), self.backoff_max) * random.uniform(0.5, 1.0)
+
+    def submit(self, **request):
+        """Start a completion on the client's loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.acomplete(**request), self.loop)
+
+    def complete(self, **request):
+        """Blocking single completion (see acomplete)."""
+        return self.submit(**request).result()
+
+    def complete_many(self, requests):
+        """
+        Run many completions concurrently (within the client's limits) and wait for all.
+
+        :param requests: Iterable of keyword-argument dicts for chat.completions.create.
+        :return: List in request order holding each completion, or the exception it failed with.
+        """
+        futures = [self.submit(**request) for request in requests]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        """Request, retry, timeout and failure counters."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
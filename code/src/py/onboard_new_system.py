@@ -1,8 +1,24 @@
+import orjson
+import os
+import uuid
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
-from typing import List
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from python_multipart.multipart import MultipartParser, parse_options_header
+from typing import List, Optional
 from pydantic import BaseModel
 from NoSqlUtil import TinyDBManager  # Import the existing TinyDBManager
+from sqlUtil import SQLiteDB
+from historyCache import history_cache
+from jobUtil import JobManager, count_csv_rows
+
+# Uploaded CSVs are spooled here until their ingestion job has finished
+UPLOAD_SPOOL_DIR = "upload_spool"
+INGESTION_CHUNK_SIZE = 50000
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
 
 
 # Define the lifespan event handler
@@ -11,10 +27,24 @@ async def lifespan(app: FastAPI):
     # Initialize the TinyDBManager
     app.state.db_manager = TinyDBManager()  # Ensure you use the correct database file
     print("✅ TinyDB Manager initialized")
-    yield  # Continue running the app without closing the DB
+    # Typed, indexed per-system tables for onboarded systems
+    app.state.sql_db = SQLiteDB("onboarding.db")
+    # Background ingestion of uploaded history (one worker: loads into a system are serialised)
+    app.state.jobs = JobManager(max_workers=1)
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    yield  # Continue running the app
+    app.state.jobs.shutdown(wait=True)
+    # Persist everything still held in TinyDB's write cache
+    app.state.db_manager.close()
 
 # Initialize FastAPI with lifespan handler
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+
+
+def ndjson_line(obj):
+    """One NDJSON line, serialised with orjson (NaN becomes null)."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
 
 class RegisterSystemRequest(BaseModel):
     system_name: str
@@ -29,6 +59,14 @@ class HistoricalDataRequest(BaseModel):
     system_name: str
     query_params: dict
 
+class BulkHistoricalDataRequest(BaseModel):
+    system_name: str
+    filters: List[dict]
+    columns: Optional[List[str]] = None
+    limit: Optional[int] = None
+    offset: int = 0
+    cursor: Optional[str] = None
+
 @app.get("/")
 def read_root():
     return {"message": "FastAPI is running with TinyDBManager!"}
@@ -38,7 +76,9 @@ def read_root():
 def register_system(data: RegisterSystemRequest):
     """Register a new system and store its metadata"""
     try:
-        app.state.db_manager.register_system(data.system_name, data.key_columns, data.criteria_columns)
+        # Flushed before replying, so an acknowledged registration survives a crash
+        app.state.db_manager.register_system(data.system_name, data.key_columns, data.criteria_columns, flush=True)
+        app.state.sql_db.register_system(data.system_name, data.key_columns, data.criteria_columns)
         return {"message": f"System '{data.system_name}' registered successfully."}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -47,18 +87,218 @@ def register_system(data: RegisterSystemRequest):
 def upload_csv(data: UploadCSV):
     """Load data from CSV into the corresponding system's table"""
     try:
-        app.state.db_manager.load_csv_to_system(data.system_name, data.file_path)
+        app.state.db_manager.load_csv_to_system(data.system_name, data.file_path, flush=True)
+        app.state.sql_db.load_csv_to_system(data.system_name, data.file_path)
         return {"message": f"Data loaded successfully for system '{data.system_name}'."}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def ingest_csv(job, system_name, csv_path):
+    """
+    Background job: load a spooled CSV into the system's TinyDB and SQLite tables.
+
+    Every row is counted once per store, so total_rows is twice the file's row count.
+    """
+    try:
+        job.set_total(2 * count_csv_rows(csv_path))
+        loaded = app.state.db_manager.load_csv_to_system(
+            system_name, csv_path, flush=True, chunk_size=INGESTION_CHUNK_SIZE, progress=job.progress
+        )
+        indexed = app.state.sql_db.load_csv_to_system(
+            system_name, csv_path, INGESTION_CHUNK_SIZE, progress=job.progress
+        )
+        return {"tinydb_rows": loaded, "sql_rows": indexed}
+    finally:
+        os.remove(csv_path)
+
+async def spool_multipart(request, file_field, spool_path):
+    """
+    Stream a multipart/form-data request body to disk as it arrives: the `file_field`
+    part is written straight to spool_path and the other parts are returned as form fields.
+
+    :return: Tuple (form fields dict, uploaded file name or None if the file part was missing).
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    fields, part, header = {}, {}, {"field": b"", "value": b""}
+    upload = {"file_name": None}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, data=[], name="", is_file=False)
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][header["field"].lower()] = header["value"]
+        header.update(field=b"", value=b"")
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode()
+        if part["name"] == file_field and b"filename" in disposition:
+            part["is_file"] = True
+            upload["file_name"] = disposition[b"filename"].decode()
+
+    def on_part_data(data, start, end):
+        if part["is_file"]:
+            spool.write(data[start:end])
+        else:
+            part["data"].append(data[start:end])
+
+    def on_part_end():
+        if not part["is_file"]:
+            fields[part["name"]] = b"".join(part["data"]).decode()
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    with open(spool_path, "wb") as spool:
+        async for chunk in request.stream():
+            # Parsing and the file writes run off the event loop
+            await run_in_threadpool(parser.write, chunk)
+        parser.finalize()
+    return fields, upload["file_name"]
+
+@app.post("/upload_csv_async/", status_code=202)
+async def upload_csv_async(request: Request):
+    """
+    Ingest an uploaded CSV (multipart form: system_name, file) in the background; poll
+    /jobs/{job_id} for progress. The file is streamed to disk as it is received.
+    """
+    spool_path = os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}.csv")
+    try:
+        fields, file_name = await spool_multipart(request, "file", spool_path)
+        system_name = fields.get("system_name")
+        if not system_name or file_name is None:
+            raise HTTPException(status_code=400, detail="Both system_name and file are required")
+        try:
+            app.state.sql_db.get_system_metadata(system_name)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = app.state.jobs.submit(
+        "ingestion", ingest_csv, system_name, spool_path,
+        system_name=system_name, file_name=file_name, bytes=os.path.getsize(spool_path)
+    )
+    return {"job_id": job.job_id, "status": job.state}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Progress of a background job: rows processed (ingested), throughput and errors"""
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job.status()
+
+@app.get("/jobs/")
+def list_jobs():
+    """Status of all background jobs, newest first"""
+    return {"jobs": app.state.jobs.list()}
+
+def _sql_table(system_name):
+    """Name of the system's typed SQLite table, or None if it was only registered in TinyDB."""
+    try:
+        return app.state.sql_db.get_system_metadata(system_name)["table_name"]
+    except ValueError:
+        return None
+
+def fetch_history(system_name, filters):
+    """
+    History rows of a system matching equality filters.
+
+    Looked up through the system's typed SQLite table, whose composite key index serves
+    key filters; systems registered only in TinyDB are still read from there. Both
+    serve key lookups from the shared history_cache (reported by /cache_stats/).
+    """
+    if _sql_table(system_name):
+        return app.state.sql_db.get_system_history(system_name, filters)
+    return app.state.db_manager.get_historical_data(system_name, filters)
+
 @app.get("/get_historical_data/")
 def get_historical_data(data: HistoricalDataRequest):
     """Fetch historical data for a system based on query params"""
     print(data.system_name)
     print(data.query_params)
     try:
-        data = app.state.db_manager.get_historical_data(data.system_name, data.query_params)
-        return {"historical_data": data}
+        data = fetch_history(data.system_name, data.query_params)
+        # Serialise the rows directly with orjson, skipping FastAPI's jsonable_encoder
+        return ORJSONResponse({"historical_data": data})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_cursor(cursor):
+    """Cursor "filter_index:record_index" -> (filter_index, record_index)"""
+    try:
+        filter_index, record_index = (int(part) for part in cursor.split(":"))
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{cursor}'")
+    return filter_index, record_index
+
+@app.post("/historical_data/bulk/")
+def get_historical_data_bulk(data: BulkHistoricalDataRequest):
+    """
+    Fetch historical data for many filters in one request, streamed as NDJSON.
+
+    Each line is one record tagged with "filter_index" (its position in `filters`).
+    `columns` projects the records; `limit` caps the number of records per response,
+    skipping `offset` records first or resuming from `cursor`. When a response is cut
+    off by `limit`, its last line is {"next_cursor": "..."} to pass to the next request.
+    Unknown filter or projected columns are rejected with 400 before streaming starts.
+    """
+    if data.limit is not None and data.limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    start_filter, start_record = _parse_cursor(data.cursor) if data.cursor else (0, 0)
+    skip = 0 if data.cursor else data.offset
+    filters_list = data.filters[start_filter:]
+    if _sql_table(data.system_name) is not None:
+        # Metadata, schema and column checks once; the projection is pushed down into each query
+        try:
+            results = app.state.sql_db.iter_system_history(data.system_name, filters_list, data.columns)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        project = False
+    elif app.state.db_manager.get_key_columns(data.system_name):
+        results = (app.state.db_manager.get_historical_data(data.system_name, filters) for filters in filters_list)
+        project = data.columns is not None
+    else:
+        raise HTTPException(status_code=404, detail=f"System '{data.system_name}' is not registered")
+
+    def generate():
+        skipped = sent = 0
+        for filter_index, records in enumerate(results, start_filter):
+            first = start_record if filter_index == start_filter else 0
+            for record_index in range(first, len(records)):
+                if skipped < skip:
+                    skipped += 1
+                    continue
+                if data.limit is not None and sent == data.limit:
+                    yield ndjson_line({"next_cursor": f"{filter_index}:{record_index}"})
+                    return
+                record = records[record_index]
+                if project:
+                    record = {col: record.get(col) for col in data.columns}
+                yield ndjson_line({"filter_index": filter_index, **record})
+                sent += 1
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/cache_stats/")
+def cache_stats():
+    """Hit/miss counters of the shared historical-data cache"""
+    return history_cache.stats()
@@ -0,0 +1,357 @@
+import csv
+import json
+import os
+import time
+from datetime import date, datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from historyCache import history_cache
+from sqlUtil import (
+    HISTORY_KEY_COLUMNS, HISTORY_COLUMNS, HISTORY_CHUNK_SIZE,
+    history_key, history_arrays, map_history_header, normalise_date, shift_period, split_history_arrays, _rate,
+    _new_stats, _stats_add, _stats_summary
+)
+
+# Arrow schema of the history files (same columns as the SQLite history table).
+HISTORY_SCHEMA = pa.schema(
+    [(col, pa.string()) for col in HISTORY_KEY_COLUMNS]
+    + [("gl_balance", pa.float64()), ("ihb_balance", pa.float64()), ("difference", pa.float64()),
+       ("match_status", pa.string()), ("as_of_date", pa.date32())]
+)
+
+# Rows per Parquet row group: the unit that key/date predicate pushdown can skip.
+ROW_GROUP_SIZE = 64 * 1024
+
+# Balance cells that parse as numbers once thousands separators are removed; others load as null.
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+
+class ParquetHistoryStore:
+    """
+    Columnar history backend: one directory of key-sorted Parquet files per system.
+
+    Every load is written as new part files sorted by (group key, as_of_date), so the
+    row-group min/max statistics let key and date filters skip most of the data.
+    Reads go through Arrow with memory-mapped files and predicate pushdown.
+
+    Exposes the same get_historical_data / get_historical_data_bulk / load_csv_data /
+    load_csv_incremental contract as SQLiteDB, so detectors can switch backends via
+    the "history_backend" config key (see historyStore.open_history_store).
+    """
+
+    def __init__(self, root_dir="history_parquet", system_name="default"):
+        self.path = os.path.join(root_dir, system_name)
+        os.makedirs(self.path, exist_ok=True)
+        self._watermarks_path = os.path.join(self.path, "_watermarks.json")
+        # Newest as-of date over all part files, maintained on write (serves months= lookups)
+        self._newest_path = os.path.join(self.path, "_newest_date.json")
+        self._newest = (None, None)
+        # Namespace of this store in the shared history_cache
+        self.cache_name = f"parquet:{os.path.abspath(self.path)}"
+
+    def load_csv_data(self, csv_filepath, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Convert a history CSV into sorted Parquet part files, chunk_size rows per file.
+
+        :param csv_filepath: Path of the history extract.
+        :param chunk_size: Rows held in memory, sorted and written at a time.
+        :return: Number of records loaded.
+        """
+        started = time.perf_counter()
+        loaded = sum(self._write_part(batch) for batch in self._read_csv_batches(csv_filepath, chunk_size))
+        print(f"✅ Loaded {loaded} records into {self.path} "
+              f"({_rate(loaded, time.perf_counter() - started)} rows/s).")
+        return loaded
+
+    def load_csv_incremental(self, csv_filepath, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Append only the part of a history CSV that has not been loaded before.
+
+        Same rules as SQLiteDB.load_csv_incremental: unchanged files are skipped, dated
+        files are ingested after the stored as-of date watermark and undated files after
+        the last loaded row. Watermarks are kept in _watermarks.json next to the data.
+
+        Progress is recorded after every part file, so a load that fails part way resumes
+        after the parts it already wrote instead of writing them twice.
+
+        :return: Number of records appended.
+        """
+        source = os.path.abspath(csv_filepath)
+        stat = os.stat(source)
+        fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+        watermarks = self._read_watermarks()
+        previous = watermarks.get(source)
+        if previous and previous.get("fingerprint") == fingerprint:
+            print(f"✅ History already up to date for {csv_filepath}.")
+            return 0
+
+        started = time.perf_counter()
+        old_watermark = previous.get("watermark") if previous else None
+        rows_seen = previous.get("rows_loaded", 0) if previous else 0
+        # An interrupted load leaves fingerprint null: skip the rows it wrote
+        resume_after = rows_seen if previous and previous.get("fingerprint") is None else 0
+        # Newest date ingested; rows are filtered against old_watermark only, as the file need not be sorted
+        latest = previous.get("pending_watermark") if resume_after else old_watermark
+        with open(source, "r", newline="", encoding="utf-8") as file:
+            dated = "as_of_date" in map_history_header(next(csv.reader(file)))
+
+        loaded = total_rows = 0
+        for batch in self._read_csv_batches(source, chunk_size):
+            first_row = total_rows
+            total_rows += len(batch)
+            batch = batch.slice(max(0, min((resume_after if dated else rows_seen) - first_row, len(batch))))
+            if dated:
+                if old_watermark:
+                    batch = batch.filter(pc.greater(batch.column("as_of_date"), date.fromisoformat(old_watermark)))
+                newest = pc.max(batch.column("as_of_date")).as_py() if len(batch) else None
+                if newest and (latest is None or newest.isoformat() > latest):
+                    latest = newest.isoformat()
+            loaded += self._write_part(batch)
+            watermarks[source] = {"watermark": old_watermark, "rows_loaded": max(total_rows, rows_seen),
+                                  "fingerprint": None, "pending_watermark": latest}
+            self._write_watermarks(watermarks)
+
+        watermarks[source] = {"watermark": latest, "rows_loaded": max(total_rows, rows_seen),
+                              "fingerprint": fingerprint}
+        self._write_watermarks(watermarks)
+        print(f"✅ Appended {loaded} new records into {self.path} "
+              f"({_rate(loaded, time.perf_counter() - started)} rows/s).")
+        return loaded
+
+    def read_table(self, columns=None, filters=None):
+        """
+        Read history as an Arrow table using memory-mapped files and predicate pushdown.
+
+        :param columns: Columns to read (None for all).
+        :param filters: pyarrow filter expression or DNF list, e.g. [("currency", "=", "EUR")].
+        :return: pyarrow.Table (empty with HISTORY_SCHEMA when nothing has been loaded).
+        """
+        if not self._part_files():
+            return HISTORY_SCHEMA.empty_table().select(columns or HISTORY_SCHEMA.names)
+        return pq.read_table(
+            self.path, columns=columns, filters=filters, memory_map=True, schema=HISTORY_SCHEMA
+        )
+
+    def get_historical_data(self, new_data, months=None):
+        """
+        Retrieve historical data for a given group combination.
+
+        :param new_data: Dictionary with new data fields.
+        :param months: Only return the most recent `months` months of history (None for all).
+        :return: List of matching historical records, oldest first.
+        """
+        key = history_key(new_data)
+        expression = self._date_filter(months)
+        variant = str(expression) if expression is not None else None
+        hit, cached = history_cache.get(self.cache_name, key, variant)
+        if hit:
+            return cached
+
+        for col, value in zip(HISTORY_KEY_COLUMNS, key):
+            expression = _and(expression, pc.field(col) == value)
+        table = self.read_table(filters=expression).sort_by("as_of_date")
+        historical_data = [self._to_record(row) for row in table.to_pylist()]
+        history_cache.put(self.cache_name, key, historical_data, variant)
+        return historical_data
+
+    def get_historical_data_bulk(self, records, months=None):
+        """
+        Retrieve historical data for many group combinations in one scan.
+
+        :param records: Iterable of dictionaries with the key fields.
+        :param months: Only return the most recent `months` months of history (None for all).
+        :return: Dictionary mapping each key tuple to its list of historical records.
+        """
+        keys = {history_key(record) for record in records}
+        grouped = {key: [] for key in keys}
+        if not keys:
+            return grouped
+
+        # Push down per-column membership (prunes row groups), then keep the exact key combinations
+        expression = self._date_filter(months)
+        for idx, col in enumerate(HISTORY_KEY_COLUMNS):
+            expression = _and(expression, pc.field(col).isin(sorted({key[idx] for key in keys})))
+        for row in self.read_table(filters=expression).sort_by("as_of_date").to_pylist():
+            key = tuple(row[col] for col in HISTORY_KEY_COLUMNS)
+            if key in grouped:
+                grouped[key].append(self._to_record(row))
+        return grouped
+
+    def get_history_stats_bulk(self, records):
+        """
+        Summary statistics for many group combinations (same shape as SQLiteDB.get_history_stats_bulk).
+
+        Computed from one bulk scan; keys without history are omitted.
+        """
+        summaries = {}
+        for key, history in self.get_historical_data_bulk(records).items():
+            if not history:
+                continue
+            stats = _new_stats()
+            for record in history:
+                _stats_add(stats, tuple(record[col] for col in HISTORY_COLUMNS))
+            summaries[key] = _stats_summary(stats)
+        return summaries
+
+    def get_historical_arrays(self, new_data, months=None):
+        """Retrieve a key's history as NumPy column arrays, oldest first (same layout as SQLiteDB)."""
+        return self.get_historical_arrays_bulk([new_data], months)[history_key(new_data)]
+
+    def get_historical_arrays_bulk(self, records, months=None):
+        """
+        Retrieve history for many keys as NumPy column arrays in one scan.
+
+        :return: Dictionary mapping each key tuple to its column arrays (empty arrays for keys without history).
+        """
+        keys = {history_key(record) for record in records}
+        empty = history_arrays([], [], [], [], [])
+        grouped = {key: empty for key in keys}
+        if not keys:
+            return grouped
+
+        expression = self._date_filter(months)
+        for idx, col in enumerate(HISTORY_KEY_COLUMNS):
+            expression = _and(expression, pc.field(col).isin(sorted({key[idx] for key in keys})))
+        table = self.read_table(filters=expression)
+        table = table.sort_by([(col, "ascending") for col in HISTORY_KEY_COLUMNS + ("as_of_date",)])
+        if not len(table):
+            return grouped
+
+        joined = pc.binary_join_element_wise(*[table.column(col) for col in HISTORY_KEY_COLUMNS], "\x1f")
+        joined = joined.to_numpy(zero_copy_only=False)
+        boundaries = np.flatnonzero(joined[1:] != joined[:-1]) + 1
+        arrays = history_arrays(
+            table.column("as_of_date").to_numpy(zero_copy_only=False),
+            table.column("gl_balance").to_numpy(zero_copy_only=False),
+            table.column("ihb_balance").to_numpy(zero_copy_only=False),
+            table.column("difference").to_numpy(zero_copy_only=False),
+            table.column("match_status").fill_null("").to_numpy(zero_copy_only=False),
+        )
+        for start, group in zip(np.concatenate(([0], boundaries)), split_history_arrays(arrays, boundaries)):
+            key = tuple(joined[start].split("\x1f"))
+            if key in grouped:
+                grouped[key] = group
+        return grouped
+
+    def _date_filter(self, months):
+        """Filter expression restricting as_of_date to the most recent `months` months."""
+        if not months:
+            return None
+        newest = self._newest_date()
+        if newest is None:
+            return None
+        start = date.fromisoformat(shift_period(newest[:7], 1 - months) + "-01")
+        return pc.field("as_of_date") >= start
+
+    def _newest_date(self):
+        """
+        Newest as-of date in the store (ISO text, None when undated), read from _newest_date.json.
+
+        The file is re-read only when another writer has changed it; stores written before it
+        existed get it built once from a scan of the date column.
+        """
+        try:
+            mtime = os.stat(self._newest_path).st_mtime_ns
+        except FileNotFoundError:
+            newest = pc.max(self.read_table(columns=["as_of_date"]).column("as_of_date")).as_py()
+            self._save_newest_date(newest.isoformat() if newest else None)
+            return self._newest[1]
+        if self._newest[0] != mtime:
+            with open(self._newest_path) as file:
+                self._newest = (mtime, json.load(file)["newest_as_of_date"])
+        return self._newest[1]
+
+    def _save_newest_date(self, newest):
+        with open(self._newest_path, "w") as file:
+            json.dump({"newest_as_of_date": newest}, file)
+        self._newest = (os.stat(self._newest_path).st_mtime_ns, newest)
+
+    def _read_csv_batches(self, csv_filepath, chunk_size):
+        """Stream a history CSV as Arrow tables of up to chunk_size rows in HISTORY_SCHEMA."""
+        with open(csv_filepath, "r", newline="", encoding="utf-8") as file:
+            header = next(csv.reader(file))
+        mapping = map_history_header(header)
+        # Read everything as text so key columns keep leading zeros; types are applied below
+        reader = pv.open_csv(
+            csv_filepath,
+            read_options=pv.ReadOptions(block_size=1 << 22),
+            convert_options=pv.ConvertOptions(column_types={name: pa.string() for name in header})
+        )
+        pending, pending_rows = [], 0
+        for batch in reader:
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= chunk_size:
+                yield self._to_history_table(pa.Table.from_batches(pending), header, mapping)
+                pending, pending_rows = [], 0
+        if pending:
+            yield self._to_history_table(pa.Table.from_batches(pending), header, mapping)
+
+    @staticmethod
+    def _to_history_table(raw, header, mapping):
+        """Map a raw all-text CSV table onto HISTORY_SCHEMA."""
+        arrays = []
+        for field in HISTORY_SCHEMA:
+            if field.name not in mapping:
+                arrays.append(pa.nulls(raw.num_rows, field.type))
+                continue
+            column = raw.column(header[mapping[field.name]])
+            if field.name == "as_of_date":
+                dates = [normalise_date(value) for value in column.to_pylist()]
+                column = pa.array([date.fromisoformat(d) if d else None for d in dates], pa.date32())
+            elif pa.types.is_floating(field.type):
+                # Blank and non-numeric cells (e.g. "N/A") load as null, as in the SQLite backend
+                column = pc.utf8_trim_whitespace(pc.replace_substring(column, ",", ""))
+                numeric = pc.match_substring_regex(column, NUMBER_PATTERN)
+                invalid = pc.sum(pc.and_(pc.invert(numeric), pc.not_equal(column, ""))).as_py() or 0
+                if invalid:
+                    print(f"⚠️ {invalid} non-numeric values in '{field.name}' were stored as NULL.")
+                column = pc.cast(pc.if_else(numeric, column, pa.scalar(None, pa.string())), pa.float64())
+            arrays.append(column)
+        return pa.Table.from_arrays(arrays, schema=HISTORY_SCHEMA)
+
+    def _write_part(self, table):
+        """Write one key-sorted part file; returns the number of rows written."""
+        if not len(table):
+            return 0
+        table = table.sort_by([(col, "ascending") for col in HISTORY_KEY_COLUMNS + ("as_of_date",)])
+        name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.parquet"
+        newest = self._newest_date() if self._part_files() else None
+        pq.write_table(table, os.path.join(self.path, name), row_group_size=ROW_GROUP_SIZE)
+        written = pc.max(table.column("as_of_date")).as_py()
+        if written and (newest is None or written.isoformat() > newest):
+            self._save_newest_date(written.isoformat())
+        elif not os.path.exists(self._newest_path):
+            self._save_newest_date(newest)
+        keys = zip(*[table.column(col).to_pylist() for col in HISTORY_KEY_COLUMNS])
+        history_cache.invalidate(self.cache_name, set(keys))
+        return len(table)
+
+    def _part_files(self):
+        return [name for name in os.listdir(self.path) if name.endswith(".parquet")]
+
+    def _read_watermarks(self):
+        if not os.path.exists(self._watermarks_path):
+            return {}
+        with open(self._watermarks_path) as file:
+            return json.load(file)
+
+    def _write_watermarks(self, watermarks):
+        """Replace _watermarks.json atomically, so a crash never leaves it half written."""
+        with open(self._watermarks_path + ".tmp", "w") as file:
+            json.dump(watermarks, file, indent=2)
+        os.replace(self._watermarks_path + ".tmp", self._watermarks_path)
+
+    @staticmethod
+    def _to_record(row):
+        """Shape an Arrow row like SQLiteDB's history records."""
+        record = {col: row[col] for col in HISTORY_COLUMNS}
+        record["as_of_date"] = row["as_of_date"].isoformat() if row["as_of_date"] else None
+        return record
+
+
+def _and(left, right):
+    return right if left is None else left & right
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+import traceback
+
+
+class MicroBatchConsumer:
+    """
+    Pool of daemon threads draining a bounded queue in micro-batches.
+
+    Producers call put(item), which raises queue.Full when the queue is at capacity so
+    the caller can push back (e.g. answer 429). Each worker collects up to batch_size
+    items, or whatever arrived within max_wait_ms of the first one, and hands them to
+    handler(items) in one call.
+    """
+
+    def __init__(self, handler, maxsize=10000, workers=2, batch_size=500, max_wait_ms=200, name="consumer"):
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._metrics = {"enqueued": 0, "rejected": 0, "processed": 0, "failed": 0, "batches": 0,
+                         "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        """Enqueue an item without blocking; raises queue.Full when the queue is at capacity."""
+        try:
+            self.queue.put_nowait((time.monotonic(), item))
+        except queue.Full:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            raise
+        with self._lock:
+            self._metrics["enqueued"] += 1
+
+    def metrics(self):
+        """Queue depth, age of the oldest waiting item and throughput counters."""
+        with self.queue.mutex:
+            depth = len(self.queue.queue)
+            oldest = self.queue.queue[0][0] if depth else None
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics.update({
+            "depth": depth,
+            "capacity": self.queue.maxsize,
+            "oldest_wait_ms": round((time.monotonic() - oldest) * 1000, 1) if oldest is not None else 0.0,
+            "workers": len(self._threads),
+        })
+        return metrics
+
+    def stop(self, timeout=None):
+        """Let the workers finish what is queued, then stop them."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _next_batch(self):
+        """Block for the first item, then collect more until batch_size or max_wait."""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.handler([item for _, item in batch])
+                outcome = "processed"
+            except Exception:
+                traceback.print_exc()
+                outcome = "failed"
+            lag_ms = (time.monotonic() - batch[0][0]) * 1000
+            with self._lock:
+                self._metrics[outcome] += len(batch)
+                self._metrics["batches"] += 1
+                self._metrics["last_lag_ms"] = round(lag_ms, 1)
+                self._metrics["max_lag_ms"] = round(max(self._metrics["max_lag_ms"], lag_ms), 1)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+# A criteria value further than this many standard deviations from its key's history is an anomaly
+Z_THRESHOLD = 3.0
+# Keys with fewer historical rows than this are flagged for review instead of scored
+MIN_HISTORY_ROWS = 2
+
+
+def split_columns(columns):
+    """Column list from the comma-separated form stored for reconciliation systems."""
+    if isinstance(columns, str):
+        columns = columns.split(",")
+    return [col.strip() for col in columns if col.strip()]
+
+
+def _keys_as_text(frame, key_columns):
+    """Key columns as text so 1111 / "1111" match and leading zeros are kept."""
+    return frame[key_columns].astype(str)
+
+
+def _group_keys(frame, key_columns):
+    """Key columns for grouping: text categoricals are kept as they are (groupby runs on their codes)."""
+    return pd.DataFrame({
+        col: frame[col] if _is_text_category(frame[col]) else frame[col].astype(str) for col in key_columns
+    }, index=frame.index)
+
+
+def _is_text_category(series):
+    return isinstance(series.dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(series.cat.categories)
+
+
+def _text_index(index):
+    """A (Multi)Index with every level as plain text, so profiles join with text keys."""
+    levels = index.to_frame(index=False).astype(str)
+    if index.nlevels > 1:
+        return pd.MultiIndex.from_frame(levels)
+    return pd.Index(levels.iloc[:, 0], name=index.name)
+
+
+def history_profile(history, key_columns, criteria_columns):
+    """
+    Per-key statistics of a system's history, used to score new rows.
+
+    :param history: History DataFrame of the system.
+    :param key_columns: Columns identifying a reconciliation key.
+    :param criteria_columns: Numeric columns to score.
+    :return: DataFrame indexed by key with "history_rows" and "<col> mean" / "<col> std" per criteria column.
+    """
+    missing = [col for col in key_columns + criteria_columns if col not in history.columns]
+    if missing:
+        raise ValueError(f"History is missing columns: {missing}")
+
+    frame = _group_keys(history, key_columns)
+    for col in criteria_columns:
+        frame[col] = pd.to_numeric(history[col], errors="coerce").astype("float64")
+    grouped = frame.groupby(key_columns, sort=False, observed=True)
+    profile = grouped[criteria_columns].agg(["mean", "std"])
+    profile.columns = [f"{col} {stat}" for col, stat in profile.columns]
+    profile["history_rows"] = grouped.size()
+    profile.index = _text_index(profile.index)
+    return profile
+
+
+def score_frame(frame, profile, key_columns, criteria_columns, threshold=Z_THRESHOLD):
+    """
+    Score a chunk of new rows against a history profile, fully vectorised.
+
+    Adds "Anomaly" (Yes/No/Review), "Anomaly Score" (largest absolute z-score over the
+    criteria columns) and "Anomaly Reason" to a copy of the frame.
+
+    :param frame: DataFrame of rows to score.
+    :param profile: Output of history_profile().
+    :return: Scored copy of the frame.
+    """
+    missing = [col for col in key_columns + criteria_columns if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Prediction file is missing columns: {missing}")
+
+    stats = _keys_as_text(frame, key_columns).join(profile, on=key_columns)
+    history_rows = stats["history_rows"].fillna(0).to_numpy()
+    scores = np.zeros(len(frame))
+    worst = np.full(len(frame), "", dtype=object)
+    for col in criteria_columns:
+        value = pd.to_numeric(frame[col], errors="coerce").to_numpy(dtype=float)
+        mean = stats[f"{col} mean"].to_numpy(dtype=float)
+        std = stats[f"{col} std"].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.abs(value - mean) / std
+        # A constant history makes any change infinitely unusual, and no change not at all
+        z = np.where(std == 0, np.where(value == mean, 0.0, np.inf), z)
+        z = np.nan_to_num(z, nan=0.0)
+        worst = np.where(z > scores, col, worst)
+        scores = np.maximum(scores, z)
+
+    scored = frame.copy()
+    unseen = history_rows < MIN_HISTORY_ROWS
+    anomalous = scores > threshold
+    scored["Anomaly"] = np.where(unseen, "Review", np.where(anomalous, "Yes", "No"))
+    scored["Anomaly Score"] = np.where(unseen, np.nan, np.minimum(scores, np.finfo(float).max))
+    scored["Anomaly Reason"] = np.where(
+        unseen, "Insufficient history for key",
+        np.where(anomalous, pd.Series(worst).radd("Outlier in ").to_numpy(), "")
+    )
+    return scored
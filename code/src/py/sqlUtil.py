@@ -1,19 +1,435 @@
 import sqlite3
 import csv
-from typing import Dict, List
+import functools
+import json
+import math
+import os
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterator, List
+import numpy as np
 import pandas as pd
+from historyCache import history_cache
+
+# Columns that identify one reconciliation group in the history table.
+HISTORY_KEY_COLUMNS = (
+    "company_number", "account", "AU", "currency", "primary_account", "secondary_account"
+)
+
+
+# History table columns in storage order, with the CSV headers accepted for each one.
+HISTORY_CSV_HEADERS = {
+    "company_number": ("company_number", "Company"),
+    "account": ("account", "Account"),
+    "AU": ("AU",),
+    "currency": ("currency", "Currency"),
+    "primary_account": ("primary_account", "Primary Account"),
+    "secondary_account": ("secondary_account", "Secondary Account"),
+    "gl_balance": ("gl_balance", "GL Balance"),
+    "ihb_balance": ("ihb_balance", "IHub Balance"),
+    "difference": ("difference", "Balance Difference"),
+    "match_status": ("match_status", "Match Status"),
+    "as_of_date": ("as_of_date", "As of Date", "date"),
+}
+HISTORY_COLUMNS = tuple(HISTORY_CSV_HEADERS)
+HISTORY_NUMERIC_POSITIONS = tuple(
+    HISTORY_COLUMNS.index(col) for col in ("gl_balance", "ihb_balance", "difference")
+)
+
+# Balance columns summarised per key in history_stats, and how many recent rows it keeps.
+STATS_METRICS = ("difference", "gl_balance", "ihb_balance")
+STATS_RECENT_ROWS = 6
+
+# Integer codes for match_status in column-array fetches (anything else is -1).
+MATCH_STATUS_CODES = {"match": 0, "break": 1}
+
+# Rows read, inserted and committed per transaction when streaming history CSVs.
+HISTORY_CHUNK_SIZE = 50000
+
+# Date layouts found in the reconciliation extracts (ISO, dd-mm-yyyy and US m/d/yyyy).
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y", "%m/%d/%Y")
+
+
+def history_key(record):
+    """Return the group key tuple for a record (values normalised to TEXT like the history table)."""
+    return tuple(str(record[col]) for col in HISTORY_KEY_COLUMNS)
+
+
+def date_period(as_of_date):
+    """Monthly partition key ('YYYY-MM') of an ISO as-of date (None for undated rows)."""
+    return as_of_date[:7] if as_of_date else None
+
+
+def shift_period(period, months):
+    """Move a 'YYYY-MM' period by a number of months (negative goes back in time)."""
+    year, month = map(int, period.split("-"))
+    index = year * 12 + (month - 1) + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def normalise_date(value):
+    """Convert an as-of date from any of DATE_FORMATS to ISO 'YYYY-MM-DD' (None if empty or unparseable)."""
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+PREDICTION_INSERT = """
+    INSERT INTO predictions 
+    (company_number, account, AU, currency, primary_account, secondary_account, 
+    gl_balance, ihb_balance, difference, match_status, result, category, explanation) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def prediction_row(new_data, result, category, explanation):
+    """Build the parameter tuple for PREDICTION_INSERT."""
+    return (
+        new_data["company_number"], new_data["account"], new_data["AU"],
+        new_data["currency"], new_data["primary_account"], new_data["secondary_account"],
+        new_data["gl_balance"], new_data["ihb_balance"], new_data["difference"],
+        new_data["match_status"], result, category, explanation
+    )
+
+
+def history_arrays(as_of_dates, gl_balances, ihb_balances, differences, match_statuses):
+    """
+    Build the column-array form of a key's history from parallel column sequences.
+
+    :return: {"as_of_date": datetime64[D] (NaT when undated), "gl_balance", "ihb_balance",
+             "difference": float64 (NaN for NULL), "match_status": int8 codes (see MATCH_STATUS_CODES)}.
+    """
+    statuses = np.char.lower(np.asarray(match_statuses, dtype=str))
+    codes = np.full(len(statuses), -1, dtype=np.int8)
+    for status, code in MATCH_STATUS_CODES.items():
+        codes[statuses == status] = code
+    return {
+        "as_of_date": np.asarray(as_of_dates, dtype="datetime64[D]"),
+        "gl_balance": np.asarray(gl_balances, dtype=np.float64),
+        "ihb_balance": np.asarray(ihb_balances, dtype=np.float64),
+        "difference": np.asarray(differences, dtype=np.float64),
+        "match_status": codes,
+    }
+
+
+def split_history_arrays(arrays, boundaries):
+    """Split column arrays at row boundaries into per-group views (no copies)."""
+    starts = [0] + list(boundaries)
+    ends = list(boundaries) + [len(arrays["difference"])]
+    return [{name: column[start:end] for name, column in arrays.items()} for start, end in zip(starts, ends)]
+
+
+def _to_float(value):
+    """
+    Convert a CSV numeric cell once at load time.
+
+    :return: Tuple (float or None, valid): empty cells become NULL and are valid; cells that
+             are not numbers (e.g. "N/A") become NULL and are reported as invalid.
+    """
+    value = (value or "").strip().replace(",", "")
+    if not value:
+        return None, True
+    try:
+        return float(value), True
+    except ValueError:
+        return None, False
+
+
+def _to_numeric_column(series, name):
+    """
+    Vectorised numeric conversion of a DataFrame column for bulk inserts: thousands separators
+    are stripped first, and values that are still not numbers become NULL with a warning.
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str).str.strip().str.replace(",", "", regex=False).where(series.notna())
+    values = pd.to_numeric(series, errors="coerce")
+    invalid = int((values.isna() & series.notna() & (series != "")).sum())
+    if invalid:
+        print(f"⚠️ {invalid} non-numeric values in '{name}' were stored as NULL.")
+    return values
+
+
+def _iso_dates(series):
+    """Datetime column as ISO text ('YYYY-MM-DD', with the time only when there is one)."""
+    values = series.dropna()
+    date_only = values.empty or values.eq(values.dt.normalize()).all()
+    return series.dt.strftime("%Y-%m-%d" if date_only else "%Y-%m-%d %H:%M:%S").where(series.notna())
+
+
+def _rate(rows, elapsed):
+    """Format a rows/second throughput figure for load reports."""
+    return f"{rows / elapsed:,.0f}" if elapsed > 0 else "n/a"
+
+
+def quote_identifier(name):
+    """Quote a table/column name for SQL (onboarded systems use headers such as "GL Balance")."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_affinity(declared_type):
+    """Return the SQLite type affinity (INTEGER, REAL, TEXT, NUMERIC) of a declared column type."""
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any(t in declared_type for t in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if any(t in declared_type for t in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def map_history_header(header):
+    """
+    Map history table columns to their position in a CSV header.
+
+    :param header: List of CSV header names.
+    :return: Dictionary of history column -> CSV column index (missing columns are omitted).
+    """
+    lookup = {name.strip().lower(): idx for idx, name in enumerate(header)}
+    mapping = {}
+    for column, aliases in HISTORY_CSV_HEADERS.items():
+        for alias in aliases:
+            if alias.lower() in lookup:
+                mapping[column] = lookup[alias.lower()]
+                break
+    return mapping
+
+
+def _stats_columns():
+    """history_stats columns after the key, in storage order."""
+    columns = ["row_count"]
+    for metric in STATS_METRICS:
+        columns += [f"{metric}_count", f"{metric}_mean", f"{metric}_m2", f"{metric}_min", f"{metric}_max"]
+    return tuple(columns + ["last_as_of_date", "recent"])
+
+
+def _new_stats():
+    return {
+        "count": 0,
+        "metrics": {m: {"n": 0, "mean": 0.0, "m2": 0.0, "min": None, "max": None} for m in STATS_METRICS},
+        "last_as_of_date": None,
+        "recent": [],
+    }
+
+
+def _stats_add(stats, record):
+    """Welford update of a key's running statistics with one history tuple."""
+    row = dict(zip(HISTORY_COLUMNS, record))
+    stats["count"] += 1
+    for metric, acc in stats["metrics"].items():
+        value = row[metric]
+        if value is None:
+            continue
+        acc["n"] += 1
+        delta = value - acc["mean"]
+        acc["mean"] += delta / acc["n"]
+        acc["m2"] += delta * (value - acc["mean"])
+        acc["min"] = value if acc["min"] is None else min(acc["min"], value)
+        acc["max"] = value if acc["max"] is None else max(acc["max"], value)
+    if row["as_of_date"] and (stats["last_as_of_date"] is None or row["as_of_date"] > stats["last_as_of_date"]):
+        stats["last_as_of_date"] = row["as_of_date"]
+    stats["recent"].append([row["as_of_date"], row["gl_balance"], row["ihb_balance"], row["difference"]])
+    if len(stats["recent"]) > 2 * STATS_RECENT_ROWS:
+        stats["recent"] = _latest(stats["recent"])
+
+
+def _latest(recent):
+    """Keep the STATS_RECENT_ROWS most recent entries (by as-of date, then load order)."""
+    return sorted(recent, key=lambda entry: entry[0] or "")[-STATS_RECENT_ROWS:]
+
+
+def _stats_merge(left, right):
+    """Combine two partial statistics (Chan et al. parallel variance)."""
+    merged = _new_stats()
+    merged["count"] = left["count"] + right["count"]
+    for metric in STATS_METRICS:
+        a, b, out = left["metrics"][metric], right["metrics"][metric], merged["metrics"][metric]
+        out["n"] = a["n"] + b["n"]
+        if out["n"]:
+            delta = b["mean"] - a["mean"]
+            out["mean"] = a["mean"] + delta * b["n"] / out["n"]
+            out["m2"] = a["m2"] + b["m2"] + delta * delta * a["n"] * b["n"] / out["n"]
+            out["min"] = min(v for v in (a["min"], b["min"]) if v is not None)
+            out["max"] = max(v for v in (a["max"], b["max"]) if v is not None)
+    dates = [d for d in (left["last_as_of_date"], right["last_as_of_date"]) if d]
+    merged["last_as_of_date"] = max(dates) if dates else None
+    merged["recent"] = _latest(left["recent"] + right["recent"])
+    return merged
+
+
+def _stats_to_row(stats):
+    row = [stats["count"]]
+    for metric in STATS_METRICS:
+        acc = stats["metrics"][metric]
+        row += [acc["n"], acc["mean"], acc["m2"], acc["min"], acc["max"]]
+    return tuple(row + [stats["last_as_of_date"], json.dumps(_latest(stats["recent"]))])
+
+
+def _stats_from_row(row):
+    stats = _new_stats()
+    stats["count"] = row[0]
+    for idx, metric in enumerate(STATS_METRICS):
+        n, mean, m2, low, high = row[1 + 5 * idx: 6 + 5 * idx]
+        stats["metrics"][metric] = {"n": n, "mean": mean, "m2": m2, "min": low, "max": high}
+    stats["last_as_of_date"] = row[-2]
+    stats["recent"] = json.loads(row[-1]) if row[-1] else []
+    return stats
+
+
+def _stats_summary(stats):
+    """Public shape of a key's statistics: mean/std/min/max per metric plus the recent rows."""
+    summary = {"count": stats["count"], "last_as_of_date": stats["last_as_of_date"]}
+    for metric, acc in stats["metrics"].items():
+        std = math.sqrt(acc["m2"] / (acc["n"] - 1)) if acc["n"] > 1 else 0.0
+        summary[metric] = {"mean": acc["mean"], "std": std, "min": acc["min"], "max": acc["max"]}
+    summary["recent"] = [
+        dict(zip(("as_of_date", "gl_balance", "ihb_balance", "difference"), entry))
+        for entry in _latest(stats["recent"])
+    ]
+    return summary
+
+
+class _ThreadConnection:
+    """A thread's own connection, held in its thread-local so it is released when the thread ends."""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionManager:
+    """
+    Hands out SQLite connections to the threads of a multi-worker server.
+
+    For a file database every thread gets its own connection (and cursor), opened in
+    WAL mode so readers never wait for the writer. Writes start with BEGIN IMMEDIATE
+    and wait up to busy_timeout_ms for the write lock instead of failing with
+    "database is locked". A thread's connection is closed when the thread exits, so
+    servers that start a thread per request do not accumulate open connections.
+
+    An in-memory database only exists inside one connection, so it is shared by all
+    threads and every operation is serialised through `lock` (see serialized()).
+    """
+
+    def __init__(self, db_path=":memory:", busy_timeout_ms=5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.in_memory = db_path == ":memory:"
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self._connections = set()
+        self._shared = self._connect() if self.in_memory else None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level="IMMEDIATE",
+            check_same_thread=False
+        )
+        if not self.in_memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        with self.lock:
+            self._connections.add(conn)
+        return conn
+
+    def connection(self):
+        """Return the calling thread's connection (the shared one for :memory:)."""
+        if self.in_memory:
+            return self._shared
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ThreadConnection(self._connect())
+            # The thread-local (and so the holder) is dropped when the thread ends
+            weakref.finalize(holder, self._release, holder.conn)
+        return holder.conn
+
+    def _release(self, conn):
+        """Close a connection whose thread has ended."""
+        with self.lock:
+            self._connections.discard(conn)
+        conn.close()
+
+    def open_connections(self):
+        """Number of connections currently open."""
+        with self.lock:
+            return len(self._connections)
+
+    def cursor(self):
+        """Return the calling thread's cursor, so execute/fetch pairs never interleave across threads."""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self.connection().cursor()
+        return cursor
+
+    def serialized(self):
+        """Context that serialises access to a shared in-memory connection (no-op for files)."""
+        return self.lock if self.in_memory else nullcontext()
+
+    def close(self):
+        """Close every connection opened by any thread."""
+        with self.lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = set()
+        self._local = threading.local()
+
+
+def _serialized(method):
+    """Run a SQLiteDB method under its connection manager's serialisation lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._connections.serialized():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class SQLiteDB:
-    def __init__(self):
-        """Initialize an in-memory SQLite database."""
-        self.conn = sqlite3.connect(":memory:")  # In-memory DB
-        self.cursor = self.conn.cursor()
-        self._create_table()
+    def __init__(self, db_path=":memory:", busy_timeout_ms=5000, retention_months=None):
+        """
+        Initialize the SQLite database.
+
+        :param db_path: ":memory:" (default) for a throwaway database, or a file path for a
+                        persistent history store that survives restarts.
+        :param busy_timeout_ms: How long a writer waits for another writer before giving up.
+        :param retention_months: Months of raw history kept per load (None keeps everything);
+                                 older months are rolled up into history_rollup (see apply_retention).
+
+        The instance can be shared between server worker threads: conn and cursor
+        always resolve to the calling thread's own connection (see ConnectionManager).
+        """
+        self.db_path = db_path or ":memory:"
+        self.retention_months = retention_months
+        self._connections = ConnectionManager(self.db_path, busy_timeout_ms)
+        # Namespace of this store in the shared history_cache
+        self.cache_name = f"sqlite:{os.path.abspath(self.db_path)}" if self.db_path != ":memory:" else f"sqlite:memory:{id(self)}"
+        with self._connections.serialized():
+            self._create_table()
+
+    @property
+    def conn(self):
+        """The calling thread's connection."""
+        return self._connections.connection()
+
+    @property
+    def cursor(self):
+        """The calling thread's cursor."""
+        return self._connections.cursor()
 
     def _create_table(self):
         """Create the historical data table."""
         self.cursor.execute("""
-        CREATE TABLE history (
+        CREATE TABLE IF NOT EXISTS history (
             company_number TEXT, 
             account TEXT, 
             AU TEXT, 
@@ -23,9 +439,53 @@ class SQLiteDB:
             gl_balance REAL, 
             ihb_balance REAL, 
             difference REAL, 
-            match_status TEXT
+            match_status TEXT,
+            as_of_date TEXT,
+            period TEXT
+        )
+        """)
+        # Stores created before monthly partitioning get the partition key backfilled
+        self.cursor.execute("PRAGMA table_info(history)")
+        if "period" not in {row[1] for row in self.cursor.fetchall()}:
+            self.cursor.execute("ALTER TABLE history ADD COLUMN period TEXT")
+            self.cursor.execute("UPDATE history SET period = substr(as_of_date, 1, 7)")
+
+        # History is partitioned by month through the period key: the composite index on
+        # (group key, period) serves per-key lookups and restricts recent-trend lookups to
+        # the last few partitions; idx_history_period serves retention and rollups.
+        self.cursor.execute("DROP INDEX IF EXISTS idx_history_key")
+        self.cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_history_key_period ON history (
+            company_number, account, AU, currency, primary_account, secondary_account, period
+        )
+        """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_period ON history (period)")
+
+        # Per-key monthly summaries of raw history that has aged out of the retention window
+        # ({m}_count counts the non-null values of each metric, the divisor of its mean)
+        rollup_columns = ", ".join(
+            f"{m}_sum REAL, {m}_min REAL, {m}_max REAL, {m}_count INTEGER" for m in STATS_METRICS
+        )
+        self.cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS history_rollup (
+            company_number TEXT, account TEXT, AU TEXT, currency TEXT,
+            primary_account TEXT, secondary_account TEXT,
+            period TEXT,
+            row_count INTEGER,
+            {rollup_columns},
+            last_as_of_date TEXT,
+            PRIMARY KEY (company_number, account, AU, currency, primary_account, secondary_account, period)
         )
         """)
+        self.cursor.execute("PRAGMA table_info(history_rollup)")
+        rollup_existing = {row[1] for row in self.cursor.fetchall()}
+        for m in STATS_METRICS:
+            if f"{m}_count" not in rollup_existing:
+                # Older rollups kept no per-metric count: assume every row of a summed metric had a value
+                self.cursor.execute(f"ALTER TABLE history_rollup ADD COLUMN {m}_count INTEGER")
+                self.cursor.execute(
+                    f"UPDATE history_rollup SET {m}_count = CASE WHEN {m}_sum IS NULL THEN 0 ELSE row_count END"
+                )
 
         self.cursor.execute("""
         CREATE TABLE IF NOT EXISTS predictions (
@@ -36,56 +496,524 @@ class SQLiteDB:
             match_status TEXT, result TEXT, category TEXT, explanation TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
         """)
+
+        # Newest-first keyset pagination, optionally narrowed by result, category or company
+        for name, columns in (
+            ("idx_predictions_time", "timestamp, id"),
+            ("idx_predictions_result", "result, timestamp, id"),
+            ("idx_predictions_category", "category, timestamp, id"),
+            ("idx_predictions_company", "company_number, timestamp, id"),
+        ):
+            self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON predictions ({columns})")
+
+        # One row per CSV source: how far it has been ingested into history. While a load is
+        # in progress (or after it failed) fingerprint is NULL, rows_loaded counts the rows
+        # already committed and pending_watermark the newest date among them.
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS load_watermarks (
+            source TEXT PRIMARY KEY,
+            watermark TEXT,
+            rows_loaded INTEGER,
+            fingerprint TEXT,
+            loaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            pending_watermark TEXT
+        )
+        """)
+        self.cursor.execute("PRAGMA table_info(load_watermarks)")
+        if "pending_watermark" not in {row[1] for row in self.cursor.fetchall()}:
+            self.cursor.execute("ALTER TABLE load_watermarks ADD COLUMN pending_watermark TEXT")
+        self._create_metadata_table()
+
+        # Running per-key statistics, maintained incrementally as history is loaded
+        metric_columns = ", ".join(
+            f"{m}_count INTEGER, {m}_mean REAL, {m}_m2 REAL, {m}_min REAL, {m}_max REAL" for m in STATS_METRICS
+        )
+        self.cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS history_stats (
+            company_number TEXT, account TEXT, AU TEXT, currency TEXT,
+            primary_account TEXT, secondary_account TEXT,
+            row_count INTEGER,
+            {metric_columns},
+            last_as_of_date TEXT,
+            recent TEXT,
+            PRIMARY KEY (company_number, account, AU, currency, primary_account, secondary_account)
+        )
+        """)
+        self.conn.commit()
+
+        # A store written before history_stats existed gets its statistics built once
+        self.cursor.execute(
+            "SELECT EXISTS(SELECT 1 FROM history) AND NOT EXISTS(SELECT 1 FROM history_stats)"
+        )
+        if self.cursor.fetchone()[0]:
+            self.rebuild_history_stats()
+
+    @_serialized
+    def load_csv_data(self, csv_filepath, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Load historical data from a CSV file into the database.
+
+        The file is streamed in chunks of chunk_size rows, so memory stays bounded
+        regardless of the extract size; each chunk is committed as its own transaction.
+
+        :param csv_filepath: Path of the history extract.
+        :param chunk_size: Number of rows read, inserted and committed at a time.
+        :return: Number of records loaded.
+        """
+        loaded, _, invalid, elapsed = self._stream_history_csv(csv_filepath, chunk_size)
+        print(f"✅ Loaded {loaded} records into the database ({_rate(loaded, elapsed)} rows/s).")
+        if invalid:
+            print(f"⚠️ {invalid} non-numeric balance values were stored as NULL.")
+        if loaded and self.retention_months:
+            self.apply_retention(self.retention_months)
+        return loaded
+
+    @_serialized
+    def load_csv_incremental(self, csv_filepath, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Append only the part of a history CSV that has not been loaded before.
+
+        Files with an as-of date column are ingested for dates after the stored watermark;
+        undated files are treated as append-only and ingested after the last loaded row.
+        An unchanged file (same size and modification time) is skipped without being read.
+
+        Progress is committed with every chunk, so a load that fails part way resumes after
+        the rows it already committed instead of ingesting them twice.
+
+        :param csv_filepath: Path of the history extract.
+        :param chunk_size: Number of rows read, inserted and committed at a time.
+        :return: Number of records appended.
+        """
+        source = os.path.abspath(csv_filepath)
+        stat = os.stat(source)
+        fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+
+        self.cursor.execute(
+            "SELECT watermark, rows_loaded, fingerprint, pending_watermark FROM load_watermarks WHERE source=?",
+            (source,)
+        )
+        previous = self.cursor.fetchone()
+        if previous and previous[2] == fingerprint:
+            print(f"✅ History already up to date for {csv_filepath} (watermark {previous[0] or previous[1]}).")
+            return 0
+        old_watermark, rows_seen = (previous[0], previous[1] or 0) if previous else (None, 0)
+        # An interrupted load leaves fingerprint NULL: skip the rows it committed
+        resume_after = rows_seen if previous and previous[2] is None else 0
+
+        with open(source, 'r', newline='', encoding='utf-8') as file:
+            dated = "as_of_date" in map_history_header(next(csv.reader(file)))
+        latest = {"date": previous[3] if resume_after else old_watermark}
+
+        def keep(row_number, record):
+            if not dated:
+                return row_number > rows_seen
+            if row_number <= resume_after:
+                return False
+            as_of_date = record[-1]
+            if old_watermark is None or (as_of_date is not None and as_of_date > old_watermark):
+                if as_of_date is not None and (latest["date"] is None or as_of_date > latest["date"]):
+                    latest["date"] = as_of_date
+                return True
+            return False
+
+        def checkpoint(rows_read):
+            # Written in the chunk's own transaction, so progress and rows commit together
+            self.cursor.execute("""
+            INSERT OR REPLACE INTO load_watermarks
+                (source, watermark, rows_loaded, fingerprint, loaded_at, pending_watermark)
+            VALUES (?, ?, ?, NULL, CURRENT_TIMESTAMP, ?)
+            """, (source, old_watermark, max(rows_read, rows_seen), latest["date"]))
+
+        loaded, total_rows, invalid, elapsed = self._stream_history_csv(source, chunk_size, keep, checkpoint)
+        watermark = latest["date"]
+        self.cursor.execute("""
+        INSERT OR REPLACE INTO load_watermarks
+            (source, watermark, rows_loaded, fingerprint, loaded_at, pending_watermark)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, NULL)
+        """, (source, watermark, total_rows, fingerprint))
         self.conn.commit()
+        print(f"✅ Appended {loaded} new records into the database "
+              f"(watermark {watermark or total_rows}, {_rate(total_rows, elapsed)} rows/s).")
+        if invalid:
+            print(f"⚠️ {invalid} non-numeric balance values were stored as NULL.")
+        if loaded and self.retention_months:
+            self.apply_retention(self.retention_months)
+        return loaded
+
+    def _stream_history_csv(self, csv_filepath, chunk_size, keep=None, checkpoint=None):
+        """
+        Stream a history CSV into the history table chunk by chunk.
 
-    def load_csv_data(self, csv_filepath):
-        """Load historical data from a CSV file into the database."""
+        :param keep: Optional callable(row_number, record) -> bool selecting the rows to insert.
+        :param checkpoint: Optional callable(rows_read) run inside each chunk's transaction,
+                           before it commits (used to persist load progress).
+        :return: Tuple (rows inserted, rows read, non-numeric balance cells stored as NULL, elapsed seconds).
+        """
+        started = time.perf_counter()
+        inserted = read = 0
+        invalid = [0]
         with open(csv_filepath, 'r', newline='', encoding='utf-8') as file:
             reader = csv.reader(file)
-            next(reader)  # Skip header row
-            data = [tuple(row) for row in reader]  # Convert rows to tuples
-        
-        self.cursor.executemany("""
-        INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, data)
+            mapping = map_history_header(next(reader))
+            for rows in iter(lambda: list(islice(reader, chunk_size)), []):
+                chunk = []
+                for row in rows:
+                    read += 1
+                    invalid_before = invalid[0]
+                    record = self._csv_row_to_history(row, mapping, invalid)
+                    if keep is None or keep(read, record):
+                        chunk.append(record)
+                    else:
+                        invalid[0] = invalid_before
+                if chunk:
+                    self._insert_history(chunk)
+                    inserted += len(chunk)
+                if checkpoint is not None:
+                    checkpoint(read)
+                if chunk or checkpoint is not None:
+                    self.conn.commit()
+        return inserted, read, invalid[0], time.perf_counter() - started
+
+    @staticmethod
+    def _csv_row_to_history(row, mapping, invalid=None):
+        """
+        Build a typed history tuple (HISTORY_COLUMNS order) from a CSV row using a header mapping.
+
+        :param invalid: Optional one-item list counting non-numeric balance cells (stored as NULL).
+        """
+        values = [row[mapping[col]] if col in mapping else None for col in HISTORY_COLUMNS]
+        for idx in HISTORY_NUMERIC_POSITIONS:
+            values[idx], valid = _to_float(values[idx])
+            if not valid and invalid is not None:
+                invalid[0] += 1
+        values[-1] = normalise_date(values[-1])
+        return tuple(values)
+
+    def _insert_history(self, data):
+        """Insert history tuples in HISTORY_COLUMNS order and fold them into history_stats (the caller commits)."""
+        columns = ", ".join(HISTORY_COLUMNS + ("period",))
+        placeholders = ", ".join("?" for _ in range(len(HISTORY_COLUMNS) + 1))
+        self.cursor.executemany(
+            f"INSERT INTO history ({columns}) VALUES ({placeholders})",
+            (record + (date_period(record[-1]),) for record in data)
+        )
+        self._update_history_stats(data)
+        history_cache.invalidate(self.cache_name, {record[:len(HISTORY_KEY_COLUMNS)] for record in data})
+
+    @_serialized
+    def apply_retention(self, retention_months):
+        """
+        Roll raw history older than the retention window into monthly per-key summaries.
+
+        The window is counted back from the newest loaded month, so re-running a load of an
+        old extract is deterministic. Rolled-up months are merged into history_rollup and
+        their raw rows deleted in one transaction. Undated rows and history_stats are untouched.
+
+        :param retention_months: Number of most recent months of raw history to keep.
+        :return: Number of raw rows rolled up.
+        """
+        self.cursor.execute("SELECT MAX(period) FROM history")
+        newest = self.cursor.fetchone()[0]
+        if newest is None:
+            return 0
+        cutoff = shift_period(newest, 1 - retention_months)
+
+        keys = ", ".join(HISTORY_KEY_COLUMNS)
+        metric_columns = ", ".join(f"{m}_sum, {m}_min, {m}_max, {m}_count" for m in STATS_METRICS)
+        aggregates = ", ".join(f"SUM({m}), MIN({m}), MAX({m}), COUNT({m})" for m in STATS_METRICS)
+        # A side with no values (NULL sum/min/max) must not null out the other side
+        merges = ", ".join(
+            f"{m}_sum = COALESCE({m}_sum + excluded.{m}_sum, {m}_sum, excluded.{m}_sum), "
+            f"{m}_min = COALESCE(MIN({m}_min, excluded.{m}_min), {m}_min, excluded.{m}_min), "
+            f"{m}_max = COALESCE(MAX({m}_max, excluded.{m}_max), {m}_max, excluded.{m}_max), "
+            f"{m}_count = {m}_count + excluded.{m}_count"
+            for m in STATS_METRICS
+        )
+        self.cursor.execute(f"""
+        INSERT INTO history_rollup ({keys}, period, row_count, {metric_columns}, last_as_of_date)
+        SELECT {keys}, period, COUNT(*), {aggregates}, MAX(as_of_date)
+        FROM history WHERE period < ? GROUP BY {keys}, period
+        ON CONFLICT ({keys}, period) DO UPDATE SET
+            row_count = row_count + excluded.row_count, {merges},
+            last_as_of_date = COALESCE(MAX(last_as_of_date, excluded.last_as_of_date),
+                                       last_as_of_date, excluded.last_as_of_date)
+        """, (cutoff,))
+        self.cursor.execute("DELETE FROM history WHERE period < ?", (cutoff,))
+        rolled_up = self.cursor.rowcount
+        self.conn.commit()
+        if rolled_up:
+            history_cache.invalidate_system(self.cache_name)
+            print(f"✅ Rolled up {rolled_up} history records older than {cutoff}.")
+        return rolled_up
+
+    @_serialized
+    def get_monthly_rollups(self, new_data):
+        """
+        Retrieve the monthly summaries of rolled-up history for a group combination.
+
+        :param new_data: Dictionary with new data fields.
+        :return: List of {"period", "count", "last_as_of_date", and per metric {"mean", "min", "max"}}, oldest first.
+        """
+        key_filter = " AND ".join(f"{col}=?" for col in HISTORY_KEY_COLUMNS)
+        metric_columns = ", ".join(f"{m}_sum, {m}_min, {m}_max, {m}_count" for m in STATS_METRICS)
+        self.cursor.execute(
+            f"SELECT period, row_count, last_as_of_date, {metric_columns} FROM history_rollup "
+            f"WHERE {key_filter} ORDER BY period", history_key(new_data)
+        )
+        rollups = []
+        for row in self.cursor.fetchall():
+            period, count, last_as_of_date = row[:3]
+            summary = {"period": period, "count": count, "last_as_of_date": last_as_of_date}
+            for idx, metric in enumerate(STATS_METRICS):
+                total, low, high, values = row[3 + 4 * idx: 7 + 4 * idx]
+                summary[metric] = {"mean": total / values if values else None, "min": low, "max": high}
+            rollups.append(summary)
+        return rollups
+
+    def _recent_period_cutoff(self, months):
+        """First monthly partition of the `months` most recent ones (None when unrestricted or undated)."""
+        if not months:
+            return None
+        self.cursor.execute("SELECT MAX(period) FROM history")
+        newest = self.cursor.fetchone()[0]
+        return shift_period(newest, 1 - months) if newest else None
+
+    def _update_history_stats(self, data):
+        """
+        Merge a batch of history tuples into history_stats.
+
+        The batch is summarised per key with Welford's algorithm and combined with the
+        stored running mean/M2 (Chan et al. parallel update), so only the touched keys
+        are read and written and no raw history is re-scanned.
+        """
+        batch = {}
+        for record in data:
+            key = record[:len(HISTORY_KEY_COLUMNS)]
+            stats = batch.get(key)
+            if stats is None:
+                stats = batch[key] = _new_stats()
+            _stats_add(stats, record)
+        if not batch:
+            return
+
+        stats_columns = _stats_columns()
+        key_filter = " AND ".join(f"{col}=?" for col in HISTORY_KEY_COLUMNS)
+        merged = []
+        for key, stats in batch.items():
+            self.cursor.execute(f"SELECT {', '.join(stats_columns)} FROM history_stats WHERE {key_filter}", key)
+            stored = self.cursor.fetchone()
+            if stored:
+                stats = _stats_merge(_stats_from_row(stored), stats)
+            merged.append(key + _stats_to_row(stats))
+
+        columns = HISTORY_KEY_COLUMNS + stats_columns
+        self.cursor.executemany(
+            f"INSERT OR REPLACE INTO history_stats ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})",
+            merged
+        )
+
+    @_serialized
+    def rebuild_history_stats(self, chunk_size=HISTORY_CHUNK_SIZE):
+        """Recompute history_stats from scratch by streaming the history table in load order."""
+        self.cursor.execute("DELETE FROM history_stats")
+        reader = self.conn.cursor()
+        reader.execute(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history ORDER BY rowid")
+        for rows in iter(lambda: reader.fetchmany(chunk_size), []):
+            self._update_history_stats(rows)
         self.conn.commit()
-        print(f"✅ Loaded {len(data)} records into the database.")
+        print("✅ Rebuilt per-key history statistics.")
+
+    def get_history_stats(self, new_data):
+        """
+        Retrieve the running statistics for one group combination.
+
+        :param new_data: Dictionary with new data fields.
+        :return: Statistics dictionary (see get_history_stats_bulk), or None when the key has no history.
+        """
+        return self.get_history_stats_bulk([new_data]).get(history_key(new_data))
+
+    @_serialized
+    def get_history_stats_bulk(self, records):
+        """
+        Retrieve running statistics for many group combinations in one query.
+
+        Each key costs one history_stats row regardless of how many months of history it has.
+
+        :param records: Iterable of dictionaries with the key fields.
+        :return: Dictionary mapping each key tuple to {"count", "last_as_of_date", "recent",
+                 and per metric in STATS_METRICS: {"mean", "std", "min", "max"}}.
+                 Keys without history are omitted.
+        """
+        keys, lookup_keys = self._lookup_keys_cte({history_key(record) for record in records})
+        stats_columns = _stats_columns()
+        self.cursor.execute(f"""
+        {lookup_keys}
+        SELECT {', '.join('s.' + col for col in HISTORY_KEY_COLUMNS + stats_columns)}
+        FROM lookup_keys k CROSS JOIN history_stats s ON
+            s.company_number=k.company_number AND s.account=k.account AND s.AU=k.AU
+            AND s.currency=k.currency AND s.primary_account=k.primary_account
+            AND s.secondary_account=k.secondary_account
+        """, (json.dumps(keys),))
+        key_len = len(HISTORY_KEY_COLUMNS)
+        return {
+            tuple(row[:key_len]): _stats_summary(_stats_from_row(row[key_len:]))
+            for row in self.cursor.fetchall()
+        }
+
+    @staticmethod
+    def _lookup_keys_cte(keys):
+        """
+        WITH clause exposing many keys as a lookup_keys(key_id, <key columns>) table, read
+        from one JSON parameter, so bulk lookups join against the indexed tables without
+        writing anything (a staging table would take the database write lock).
+
+        :return: Tuple (keys as a list, WITH clause); bind json.dumps(keys) as its parameter.
+                 Each key's key_id is its list index.
+        """
+        columns = ", ".join(f"json_extract(value, '$[{idx}]')" for idx in range(len(HISTORY_KEY_COLUMNS)))
+        return list(keys), f"""
+        WITH lookup_keys (key_id, {', '.join(HISTORY_KEY_COLUMNS)}) AS (
+            SELECT key, {columns} FROM json_each(?)
+        )"""
+
+    @_serialized
+    def get_historical_arrays(self, new_data, months=None):
+        """
+        Retrieve a key's history as contiguous NumPy column arrays, oldest first.
+
+        Skips the per-row dictionaries of get_historical_data so scoring code can compute
+        statistics directly on the arrays (see history_arrays for the layout).
+
+        :param new_data: Dictionary with new data fields.
+        :param months: Only return the most recent `months` monthly partitions (None for all raw history).
+        """
+        return self.get_historical_arrays_bulk([new_data], months)[history_key(new_data)]
+
+    @_serialized
+    def get_historical_arrays_bulk(self, records, months=None):
+        """
+        Retrieve history for many keys as NumPy column arrays in one query.
+
+        All rows are fetched as one key-ordered result, transposed into one array per
+        column and sliced per key, so every key's arrays are views into shared buffers.
+
+        :param records: Iterable of dictionaries with the key fields.
+        :param months: Only return the most recent `months` monthly partitions (None for all raw history).
+        :return: Dictionary mapping each key tuple to its column arrays (empty arrays for keys without history).
+        """
+        keys, lookup_keys = self._lookup_keys_cte({history_key(record) for record in records})
+        cutoff = self._recent_period_cutoff(months)
+        self.cursor.execute(f"""
+        {lookup_keys}
+        SELECT k.key_id, h.as_of_date, h.gl_balance, h.ihb_balance, h.difference, h.match_status
+        FROM lookup_keys k CROSS JOIN history h ON
+            h.company_number=k.company_number AND h.account=k.account AND h.AU=k.AU
+            AND h.currency=k.currency AND h.primary_account=k.primary_account
+            AND h.secondary_account=k.secondary_account
+            {"AND h.period >= ?" if cutoff else ""}
+        ORDER BY k.key_id, h.as_of_date
+        """, (json.dumps(keys),) + ((cutoff,) if cutoff else ()))
+        rows = self.cursor.fetchall()
+
+        columns = list(zip(*rows)) if rows else [()] * 6
+        key_ids = np.asarray(columns[0], dtype=np.int64)
+        arrays = history_arrays(*columns[1:])
+        boundaries = np.flatnonzero(np.diff(key_ids)) + 1
+        group_ids = key_ids[np.concatenate(([0], boundaries))] if rows else []
 
-    def get_historical_data(self, new_data):
+        empty = history_arrays([], [], [], [], [])
+        grouped = {key: empty for key in keys}
+        for key_id, group in zip(group_ids, split_history_arrays(arrays, boundaries) if rows else []):
+            grouped[keys[key_id]] = group
+        return grouped
+
+    @_serialized
+    def get_historical_data(self, new_data, months=None):
         """
         Retrieve historical data for a given group combination.
         
         :param new_data: Dictionary with new data fields.
+        :param months: Only return the most recent `months` monthly partitions (None for all raw history).
         :return: List of matching historical records.
+
+        Results are served from the shared history_cache when possible; loads invalidate
+        the keys they touch.
         """
+        key = history_key(new_data)
+        cutoff = self._recent_period_cutoff(months)
+        hit, cached = history_cache.get(self.cache_name, key, cutoff)
+        if hit:
+            return cached
+
         query = """
         SELECT * FROM history WHERE 
             company_number=? AND account=? AND AU=? AND currency=? 
             AND primary_account=? AND secondary_account=?
         """
-        self.cursor.execute(query, (
+        params = (
             new_data["company_number"], new_data["account"], new_data["AU"],
             new_data["currency"], new_data["primary_account"], new_data["secondary_account"]
-        ))
+        )
+        if cutoff:
+            query += " AND period >= ?"
+            params += (cutoff,)
+        self.cursor.execute(query, params)
         records = self.cursor.fetchall()
-        historical_data = [
-            {
-                "company_number": row[0],
-                "account": row[1],
-                "AU": row[2],
-                "currency": row[3],
-                "primary_account": row[4],
-                "secondary_account": row[5],
-                "gl_balance": float(row[6]),
-                "ihb_balance": float(row[7]),
-                "difference": float(row[8]),
-                "match_status": row[9]
-            }
-            for row in records
-        ]
+        historical_data = [self._history_row_to_dict(row) for row in records]
 
+        history_cache.put(self.cache_name, key, historical_data, cutoff)
         return historical_data
 
+    @_serialized
+    def get_historical_data_bulk(self, records, months=None):
+        """
+        Retrieve historical data for many group combinations in one query.
+
+        The keys are passed as one JSON parameter and joined against the indexed
+        history table, so the lookup cost is one round trip instead of one per record.
+
+        :param records: Iterable of dictionaries with the key fields.
+        :param months: Only return the most recent `months` monthly partitions (None for all raw history).
+        :return: Dictionary mapping each key tuple (see HISTORY_KEY_COLUMNS) to its list of historical records.
+        """
+        keys = {history_key(record) for record in records}
+        grouped = {key: [] for key in keys}
+        if not keys:
+            return grouped
+
+        keys, lookup_keys = self._lookup_keys_cte(keys)
+        cutoff = self._recent_period_cutoff(months)
+        self.cursor.execute(f"""
+        {lookup_keys}
+        SELECT h.* FROM lookup_keys k CROSS JOIN history h ON
+            h.company_number=k.company_number AND h.account=k.account AND h.AU=k.AU
+            AND h.currency=k.currency AND h.primary_account=k.primary_account
+            AND h.secondary_account=k.secondary_account
+            {"AND h.period >= ?" if cutoff else ""}
+        """, (json.dumps(keys),) + ((cutoff,) if cutoff else ()))
+        for row in self.cursor.fetchall():
+            grouped[tuple(row[:len(HISTORY_KEY_COLUMNS)])].append(self._history_row_to_dict(row))
+        return grouped
+
+    @staticmethod
+    def _history_row_to_dict(row):
+        """Convert a history table row into the record dictionary handed to the detectors."""
+        return {
+            "company_number": row[0],
+            "account": row[1],
+            "AU": row[2],
+            "currency": row[3],
+            "primary_account": row[4],
+            "secondary_account": row[5],
+            "gl_balance": row[6],
+            "ihb_balance": row[7],
+            "difference": row[8],
+            "match_status": row[9],
+            "as_of_date": row[10]
+        }
+
+    @_serialized
     def save_prediction(self, new_data, result, category, explanation):
         """
         Save new data, result, and explanation to the predictions table.
@@ -93,31 +1021,88 @@ class SQLiteDB:
         :param result: Prediction result (e.g., "Anomaly", "Not Anomaly").
         :param explanation: Explanation for the result.
         """
-        query = """
-            INSERT INTO predictions 
-            (company_number, account, AU, currency, primary_account, secondary_account, 
-            gl_balance, ihb_balance, difference, match_status, result, category, explanation) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        self.cursor.execute(query, (
-            new_data["company_number"], new_data["account"], new_data["AU"],
-            new_data["currency"], new_data["primary_account"], new_data["secondary_account"],
-            new_data["gl_balance"], new_data["ihb_balance"], new_data["difference"],
-            new_data["match_status"], result, category, explanation
-        ))
+        self.cursor.execute(PREDICTION_INSERT, prediction_row(new_data, result, category, explanation))
         
         self.conn.commit()
         print("✅ Prediction saved successfully!")
 
+    def prediction_writer(self, batch_size=1000, flush_interval_ms=500, background=False):
+        """
+        Create a group-commit writer for the predictions table (see PredictionWriter).
+
+        Use it as a context manager in batch runs so the final flush happens on exit:
+
+            with db.prediction_writer() as writer:
+                writer.write(record, result, category, explanation)
+        """
+        return PredictionWriter(self, batch_size, flush_interval_ms, background)
+
     def close(self):
-        """Close the database connection."""
-        self.conn.close()
+        """Close the database connections of every thread."""
+        self._connections.close()
 
+    @_serialized
     def get_predictions(self):
-        self.cursor.execute("SELECT * FROM predictions ORDER BY timestamp DESC")
+        self.cursor.execute("SELECT * FROM predictions ORDER BY timestamp DESC, id DESC")
         return self.cursor.fetchall()
+
+    @_serialized
+    def get_predictions_page(self, limit=100, cursor=None, result=None, category=None,
+                             company_number=None, start_date=None, end_date=None):
+        """
+        Fetch one page of predictions, newest first, using keyset pagination on (timestamp, id).
+
+        :param limit: Maximum number of rows in the page.
+        :param cursor: next_cursor of the previous page (None for the first page).
+        :param result: Only predictions with this result (e.g. "Yes").
+        :param category: Only predictions in this category.
+        :param company_number: Only predictions for this company.
+        :param start_date: Only predictions with timestamp >= start_date ('YYYY-MM-DD[ HH:MM:SS]').
+        :param end_date: Only predictions with timestamp < end_date.
+        :return: Dictionary {"rows": [prediction dicts], "next_cursor": str or None}.
+        """
+        conditions, params = [], []
+        for column, value in (("result", result), ("category", category), ("company_number", company_number)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(str(value))
+        if start_date:
+            conditions.append("timestamp >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("timestamp < ?")
+            params.append(end_date)
+        if cursor:
+            timestamp, last_id = cursor.rsplit("|", 1)
+            conditions.append("(timestamp, id) < (?, ?)")
+            params += [timestamp, int(last_id)]
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.cursor.execute(
+            f"SELECT * FROM predictions {where_clause} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [limit]
+        )
+        columns = [desc[0] for desc in self.cursor.description]
+        rows = [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+        next_cursor = f"{rows[-1]['timestamp']}|{rows[-1]['id']}" if len(rows) == limit else None
+        return {"rows": rows, "next_cursor": next_cursor}
+
+    def iter_predictions(self, batch_size=1000, **filters):
+        """
+        Stream predictions newest first, one page of batch_size rows in memory at a time.
+
+        :param filters: Any filter accepted by get_predictions_page.
+        """
+        cursor = None
+        while True:
+            page = self.get_predictions_page(limit=batch_size, cursor=cursor, **filters)
+            yield from page["rows"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
     
+    @_serialized
     def create_table_generic(self, table_name: str, columns: Dict[str, str]):
         """
         Creates a table dynamically based on the provided column names and types.
@@ -125,12 +1110,13 @@ class SQLiteDB:
             table_name (str): Name of the table to be created.
             columns (Dict[str, str]): Dictionary where keys are column names and values are SQL types.
         """
-        columns_str = ", ".join([f"{col} {dtype}" for col, dtype in columns.items()])
-        query = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_str})"
+        columns_str = ", ".join([f"{quote_identifier(col)} {dtype}" for col, dtype in columns.items()])
+        query = f"CREATE TABLE IF NOT EXISTS {quote_identifier(table_name)} ({columns_str})"
         
         self.cursor.execute(query)
         self.conn.commit()
 
+    @_serialized
     def insert_data_generic(self, table_name: str, data: Dict[str, any]):
         """
         Inserts a row into a specified table.
@@ -138,15 +1124,16 @@ class SQLiteDB:
             table_name (str): Name of the table.
             data (Dict[str, any]): Dictionary of column-value pairs.
         """
-        columns = ", ".join(data.keys())
+        columns = ", ".join(quote_identifier(col) for col in data.keys())
         placeholders = ", ".join(["?" for _ in data])
         values = tuple(data.values())
 
-        query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        query = f"INSERT INTO {quote_identifier(table_name)} ({columns}) VALUES ({placeholders})"
         
         self.cursor.execute(query, values)
         self.conn.commit()
 
+    @_serialized
     def fetch_data_generic(self, table_name: str, conditions: Dict[str, any] = None) -> List[Dict[str, any]]:
         """
         Fetches rows from a table with optional conditions.
@@ -157,11 +1144,11 @@ class SQLiteDB:
             List[Dict[str, any]]: List of row dictionaries.
         """
         if conditions:
-            where_clause = " AND ".join([f"{col} = ?" for col in conditions.keys()])
-            query = f"SELECT * FROM {table_name} WHERE {where_clause}"
+            where_clause = " AND ".join([f"{quote_identifier(col)} = ?" for col in conditions.keys()])
+            query = f"SELECT * FROM {quote_identifier(table_name)} WHERE {where_clause}"
             values = tuple(conditions.values())
         else:
-            query = f"SELECT * FROM {table_name}"
+            query = f"SELECT * FROM {quote_identifier(table_name)}"
             values = ()
 
         self.cursor.execute(query, values)
@@ -170,31 +1157,368 @@ class SQLiteDB:
 
         return [dict(zip(columns, row)) for row in rows]
     
-    def load_csv_to_table_g(self, csv_path: str, table_name: str):
+    @_serialized
+    def load_csv_to_table_g(self, csv_path: str, table_name: str, chunk_size: int = HISTORY_CHUNK_SIZE,
+                            progress=None, on_chunk=None):
         """
         Loads data from a CSV file into the specified table.
         - The CSV headers should match the database column names.
+        - TEXT columns are read as strings (keeps leading zeros), numeric columns are converted per the table schema.
+        - The whole file is loaded in a single transaction, chunk_size rows per executemany.
+        - progress, if given, is called with the row count of each inserted chunk.
+        - on_chunk, if given, is called with each chunk DataFrame before it is inserted.
         """
-        df = pd.read_csv(csv_path)
-        
-        for _, row in df.iterrows():
-            data = row.to_dict()
-            self.insert_data(table_name, data)
+        schema = self.get_table_schema(table_name)
+        text_columns = {col: str for col, dtype in schema.items() if _sql_affinity(dtype) == "TEXT"}
 
-        print(f"✅ Loaded {len(df)} records into {table_name}")
+        started = time.perf_counter()
+        total = 0
+        try:
+            for chunk in pd.read_csv(csv_path, dtype=text_columns, chunksize=chunk_size):
+                if on_chunk:
+                    on_chunk(chunk)
+                inserted = self.bulk_insert_dataframe(table_name, chunk, commit=False)
+                total += inserted
+                if progress:
+                    progress(inserted)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        print(f"✅ Loaded {total} records into {table_name} ({_rate(total, time.perf_counter() - started)} rows/s)")
+        return total
+
+    @_serialized
+    def get_table_schema(self, table_name: str) -> Dict[str, str]:
+        """
+        Returns the declared column types of a table (as created by create_table_generic).
+        Args:
+            table_name (str): Name of the table.
+        Returns:
+            Dict[str, str]: Dictionary of column name -> declared SQL type, in table order.
+        """
+        self.cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})")
+        schema = {row[1]: row[2] for row in self.cursor.fetchall()}
+        if not schema:
+            raise ValueError(f"Table '{table_name}' does not exist")
+        return schema
+
+    @_serialized
+    def bulk_insert_dataframe(self, table_name: str, df, commit: bool = True) -> int:
+        """
+        Inserts a whole DataFrame (or Arrow table / record batch) with a single executemany.
+        Args:
+            table_name (str): Name of the table.
+            df: pandas DataFrame, or any object with a to_pandas() method (pyarrow Table/RecordBatch).
+            commit (bool): Commit after the insert; pass False to batch several frames in one transaction.
+        Returns:
+            int: Number of rows inserted.
+        """
+        if hasattr(df, "to_pandas"):
+            df = df.to_pandas()
+        schema = self.get_table_schema(table_name)
+        columns = [col for col in df.columns if col in schema]
+        ignored = [col for col in df.columns if col not in schema]
+        if ignored:
+            print(f"⚠️ Ignoring columns not in {table_name}: {ignored}")
+        if not columns or df.empty:
+            return 0
+
+        # Convert each column once, vectorised, to the Python type its SQL affinity expects
+        converted = {}
+        for col in columns:
+            affinity = _sql_affinity(schema[col])
+            series = df[col]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                # sqlite3 cannot bind Timestamps: store dates as ISO text, like the history loaders
+                series = _iso_dates(series)
+            elif affinity in ("INTEGER", "REAL"):
+                series = _to_numeric_column(series, col).astype("float64")
+                # Fractional (or infinite) values go in as floats, which SQLite stores as they are
+                if affinity == "INTEGER" and series.dropna().mod(1).eq(0).all():
+                    series = series.astype("Int64")
+            elif affinity == "TEXT":
+                series = series.where(series.isna(), series.astype(str))
+            converted[col] = series.astype(object).where(series.notna(), None)
+        frame = pd.DataFrame(converted, columns=columns)
+
+        placeholders = ", ".join("?" for _ in columns)
+        column_list = ", ".join(quote_identifier(col) for col in columns)
+        query = f"INSERT INTO {quote_identifier(table_name)} ({column_list}) VALUES ({placeholders})"
+        self.cursor.executemany(query, frame.itertuples(index=False, name=None))
+        if commit:
+            self.conn.commit()
+        return len(frame)
 
     def _create_metadata_table(self):
         """Creates metadata table if it doesn't exist"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS metadata (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    system_name TEXT NOT NULL,
-                    table_name TEXT NOT NULL,
-                    key_columns TEXT NOT NULL,
-                    criteria_columns TEXT NOT NULL,
-                    UNIQUE(system_name, table_name)  -- Prevent duplicate entries
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                system_name TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                key_columns TEXT NOT NULL,
+                criteria_columns TEXT NOT NULL,
+                column_types TEXT,
+                UNIQUE(system_name, table_name)  -- Prevent duplicate entries
+            )
+        """)
+        self.conn.commit()
+
+    @_serialized
+    def register_system(self, system_name: str, key_columns: List[str], criteria_columns: List[str],
+                        column_types: Dict[str, str] = None):
+        """
+        Registers an onboarded system and creates its typed, indexed history table.
+        Args:
+            system_name (str): Name of the reconciliation system.
+            key_columns (List[str]): Columns identifying one reconciliation group (stored as TEXT).
+            criteria_columns (List[str]): Balance columns compared by the detectors (stored as REAL).
+            column_types (Dict[str, str], optional): Extra columns or type overrides, e.g. {"As of Date": "TEXT"}.
+        Returns:
+            str: Name of the system table.
+
+        The table gets a composite index on the key columns and a covering index on
+        (key columns + criteria columns), so key lookups that read balances never touch the table.
+        """
+        table_name = f"{system_name}_data"
+        columns = {col: "TEXT" for col in key_columns}
+        columns.update({col: "REAL" for col in criteria_columns})
+        columns.update(column_types or {})
+
+        self.create_table_generic(table_name, columns)
+        table = quote_identifier(table_name)
+        key_list = ", ".join(quote_identifier(col) for col in key_columns)
+        criteria_list = ", ".join(quote_identifier(col) for col in key_columns + criteria_columns)
+        self.cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{table_name}_key')} ON {table} ({key_list})"
+        )
+        if criteria_columns:
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{table_name}_criteria')} ON {table} ({criteria_list})"
+            )
+        self.cursor.execute("""
+            INSERT OR REPLACE INTO metadata (system_name, table_name, key_columns, criteria_columns, column_types)
+            VALUES (?, ?, ?, ?, ?)
+        """, (system_name, table_name, json.dumps(key_columns), json.dumps(criteria_columns),
+              json.dumps(column_types or {})))
+        self.conn.commit()
+        # Cached lookups were keyed on the previous key columns
+        history_cache.invalidate_system(self._system_cache_name(system_name))
+        print(f"✅ Registered system: {system_name}, Table: {table_name}")
+        return table_name
+
+    @_serialized
+    def get_system_metadata(self, system_name: str) -> Dict[str, any]:
+        """
+        Returns the registered metadata of a system.
+        Returns:
+            Dict[str, any]: {"system_name", "table_name", "key_columns", "criteria_columns", "column_types"}.
+        """
+        self.cursor.execute(
+            "SELECT table_name, key_columns, criteria_columns, column_types FROM metadata WHERE system_name = ?",
+            (system_name,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            raise ValueError(f"System '{system_name}' is not registered")
+        return {
+            "system_name": system_name,
+            "table_name": row[0],
+            "key_columns": json.loads(row[1]),
+            "criteria_columns": json.loads(row[2]),
+            "column_types": json.loads(row[3] or "{}"),
+        }
+
+    @_serialized
+    def load_csv_to_system(self, system_name: str, csv_path: str, chunk_size: int = HISTORY_CHUNK_SIZE,
+                           progress=None) -> int:
+        """
+        Bulk-loads a history CSV into a registered system's table.
+        CSV columns that were not declared at registration are added as TEXT columns.
+        progress, if given, is called with the row count of each loaded chunk.
+        Cached lookups of the loaded keys are invalidated.
+        Returns:
+            int: Number of rows loaded.
+        """
+        metadata = self.get_system_metadata(system_name)
+        table_name = metadata["table_name"]
+        schema = self.get_table_schema(table_name)
+        header = pd.read_csv(csv_path, nrows=0).columns
+        # SQLite column names are case-insensitive
+        existing = {col.lower() for col in schema}
+        for col in header:
+            if col.lower() not in existing:
+                self.cursor.execute(
+                    f"ALTER TABLE {quote_identifier(table_name)} ADD COLUMN {quote_identifier(col)} TEXT"
                 )
-            """)
-            conn.commit()
\ No newline at end of file
+        key_columns = metadata["key_columns"]
+        keyed = all(col in header for col in key_columns)
+        loaded_keys = set()
+
+        def collect_keys(chunk):
+            loaded_keys.update(zip(*(chunk[col].astype(str) for col in key_columns)))
+
+        total = self.load_csv_to_table_g(csv_path, table_name, chunk_size, progress, collect_keys if keyed else None)
+        if keyed:
+            history_cache.invalidate(self._system_cache_name(system_name), loaded_keys)
+        else:
+            history_cache.invalidate_system(self._system_cache_name(system_name))
+        return total
+
+    @_serialized
+    def get_system_history(self, system_name: str, filters: Dict[str, any] = None,
+                           columns: List[str] = None) -> List[Dict[str, any]]:
+        """
+        Fetches history for a registered system using its metadata.
+        Args:
+            system_name (str): Name of the registered system.
+            filters (Dict[str, any], optional): Column-value equality filters; filtering on the
+                key columns is served by the system's composite key index.
+            columns (List[str], optional): Columns to return (default all).
+        Returns:
+            List[Dict[str, any]]: List of row dictionaries.
+
+        Lookups filtering on exactly the key columns are served from the shared history_cache
+        when possible; load_csv_to_system invalidates the keys it loads.
+        """
+        metadata = self._resolve_system_columns(system_name, [filters or {}], columns)
+        return self._query_system_history(metadata, filters or {}, columns)
+
+    def iter_system_history(self, system_name: str, filters_list: List[Dict[str, any]],
+                            columns: List[str] = None) -> Iterator[List[Dict[str, any]]]:
+        """
+        Fetches history for many filters of a registered system (see get_system_history).
+        The system's metadata and schema are read, and every filter and projected column is
+        validated, once up front; the queries then run lazily, one per filter.
+        Raises:
+            ValueError: If the system is not registered or a column is unknown.
+        Returns:
+            Iterator[List[Dict[str, any]]]: The rows of each filter, in order.
+        """
+        metadata = self._resolve_system_columns(system_name, filters_list, columns)
+        return self._iter_system_history(metadata, filters_list, columns)
+
+    def _iter_system_history(self, metadata, filters_list, columns):
+        for filters in filters_list:
+            with self._connections.serialized():
+                yield self._query_system_history(metadata, filters or {}, columns)
+
+    @_serialized
+    def _resolve_system_columns(self, system_name, filters_list, columns):
+        """Metadata of a system, after checking that the filtered and projected columns exist."""
+        metadata = self.get_system_metadata(system_name)
+        schema = self.get_table_schema(metadata["table_name"])
+        requested = [col for filters in filters_list for col in filters] + list(columns or [])
+        unknown = sorted({col for col in requested if col not in schema})
+        if unknown:
+            raise ValueError(f"Unknown columns for system '{system_name}': {unknown}")
+        return metadata
+
+    def _query_system_history(self, metadata, filters, columns):
+        """Query a system table with already validated filters and columns, through the history_cache."""
+        cache_name = self._system_cache_name(metadata["system_name"])
+        key = variant = None
+        if filters and set(filters) == set(metadata["key_columns"]):
+            key = tuple(str(filters[col]) for col in metadata["key_columns"])
+            variant = tuple(columns) if columns else None
+            hit, cached = history_cache.get(cache_name, key, variant)
+            if hit:
+                return cached
+
+        # Key columns are TEXT: compare as strings so 1111 matches '1111' and '00000' keeps its zeros
+        values = tuple(
+            str(value) if col in metadata["key_columns"] else value for col, value in filters.items()
+        )
+        select_list = ", ".join(quote_identifier(col) for col in columns) if columns else "*"
+        query = f"SELECT {select_list} FROM {quote_identifier(metadata['table_name'])}"
+        if filters:
+            query += " WHERE " + " AND ".join(f"{quote_identifier(col)} = ?" for col in filters)
+        self.cursor.execute(query, values)
+        names = [desc[0] for desc in self.cursor.description]
+        rows = [dict(zip(names, row)) for row in self.cursor.fetchall()]
+        if key is not None:
+            history_cache.put(cache_name, key, rows, variant)
+        return rows
+
+    def _system_cache_name(self, system_name):
+        """Namespace of a registered system's table in the shared history_cache."""
+        return f"{self.cache_name}:system:{system_name}"
+
+
+class PredictionWriter:
+    """
+    Buffered writer for the predictions table.
+
+    Rows are collected in memory and inserted with one executemany + commit whenever
+    batch_size rows are pending or flush_interval_ms has elapsed since the last flush,
+    so a batch run pays one fsync per batch instead of one per prediction.
+
+    With background=True (file databases only) a daemon thread also flushes on the
+    interval while the caller is idle. It writes through its own WAL connection, so
+    readers of the predictions table are never blocked for longer than one commit.
+    """
+
+    def __init__(self, db, batch_size=1000, flush_interval_ms=500, background=False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.rows_written = 0
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._owns_conn = background and db.db_path != ":memory:"
+
+        if self._owns_conn:
+            self._conn = sqlite3.connect(db.db_path, check_same_thread=False, isolation_level="IMMEDIATE")
+            self._conn.execute(f"PRAGMA busy_timeout={int(db._connections.busy_timeout_ms)}")
+            self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._thread.start()
+        else:
+            if background:
+                print("⚠️ Background flushing needs a file database; flushing on write only.")
+            self._conn = db.conn
+        self._db_lock = nullcontext() if self._owns_conn else db._connections.serialized()
+
+    def write(self, new_data, result, category, explanation):
+        """Queue one prediction; flushes when the batch size or interval is reached."""
+        with self._lock:
+            self._pending.append(prediction_row(new_data, result, category, explanation))
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Insert and commit every pending prediction."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            with self._db_lock:
+                self._conn.executemany(PREDICTION_INSERT, self._pending)
+                self._conn.commit()
+            self.rows_written += len(self._pending)
+            self._pending = []
+
+    def close(self):
+        """Stop the background flusher and flush what is left."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        if self._owns_conn:
+            self._conn.close()
+        print(f"✅ Saved {self.rows_written} predictions.")
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,580 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlUtil import ConnectionManager
+from frameUtil import concat_frames, find_date_column
+from scoringUtil import history_profile, split_columns
+
+# Appended history parts are folded into one file once a system has this many
+HISTORY_MAX_PARTS = 8
+
+
+def _row_keys(frame, columns):
+    """Rows of a frame as text tuples over columns, so int/str and float-parsed values compare equal."""
+    return pd.MultiIndex.from_frame(frame[columns].astype(str))
+
+
+def _hash_rows(frame, columns):
+    """64-bit hash of each row over columns, taking the values as text like _row_keys."""
+    hashed = np.zeros(len(frame), dtype="uint64")
+    for col in columns:
+        # Hash each distinct value once
+        codes, uniques = pd.factorize(frame[col].astype(str), use_na_sentinel=False)
+        hashed = hashed * np.uint64(1000003) ^ pd.util.hash_array(np.asarray(uniques, dtype=object))[codes]
+    return hashed
+
+
+def _history_index(history, key_columns, date_column, criteria_columns, sort=True):
+    """
+    Key index of a history: the key and as-of date hashes of every row with its criteria
+    values, sorted by key so that each key's rows are one contiguous slice.
+
+    :param sort: False keeps the rows in the history's order instead.
+    """
+    index = pd.DataFrame({
+        "key_hash": _hash_rows(history, key_columns),
+        "date_hash": _hash_rows(history, [date_column]),
+    })
+    for col in criteria_columns:
+        index[col] = pd.to_numeric(history[col], errors="coerce").astype("float64").to_numpy()
+    return index.sort_values("key_hash", kind="stable", ignore_index=True) if sort else index
+
+
+def _index_rows(index):
+    return pd.MultiIndex.from_arrays([index["key_hash"], index["date_hash"]])
+
+
+def _key_positions(index, key_hashes):
+    """Positions of the rows of the given keys in a key index (found by binary search)."""
+    keys = index["key_hash"].to_numpy()
+    start = np.searchsorted(keys, key_hashes, "left")
+    lengths = np.searchsorted(keys, key_hashes, "right") - start
+    return np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+def _insert_index_rows(index, removed, added):
+    """A key index with the rows at positions `removed` dropped and the rows of `added` inserted in key order."""
+    if len(removed):
+        keep = np.ones(len(index), dtype=bool)
+        keep[removed] = False
+        index = index[keep]
+    at = np.searchsorted(index["key_hash"].to_numpy(), added["key_hash"].to_numpy(), "right")
+    return pd.DataFrame({col: np.insert(index[col].to_numpy(), at, added[col].to_numpy()) for col in index.columns})
+
+
+def _stack_parts(parts, row_keys):
+    """Concatenate history parts, where rows of a later part replace the same rows (row_keys) of earlier ones."""
+    newer = None
+    for idx in range(len(parts) - 1, -1, -1):
+        keys = row_keys(parts[idx])
+        if newer is not None:
+            parts[idx] = parts[idx][~keys.isin(newer)]
+        newer = keys if newer is None else newer.append(keys)
+    return concat_frames(parts)
+
+
+class SystemRegistry:
+    """
+    Persistent store of reconciliation systems shared by every worker process.
+
+    System definitions and the current version of each system's frames live in a SQLite
+    database (WAL, so all gunicorn workers see the same state); the frames themselves are
+    Parquet files under root_dir. Each process keeps only a bounded working set of frames
+    in memory, evicting the least recently used once max_cache_bytes is exceeded, and
+    reloads a frame from disk when another process has written a newer version.
+
+    The per-key history profile used for scoring is computed and stored with each history
+    write, so scoring never needs the full history in memory.
+
+    History can also be merged incrementally (merge_history): each delta is stored as a new
+    part file on top of the last full write (history_base) and only the touched keys'
+    statistics are recomputed. Parts are folded back into one file every HISTORY_MAX_PARTS.
+    Every history version also has a key index (index-v<n>.parquet, stacked from its base
+    like the history) holding each row's key and as-of date hashes and criteria values,
+    so a merge looks up only the delta's keys instead of reading the whole history.
+    """
+
+    def __init__(self, root_dir="system_registry", max_cache_bytes=512 * 1024 * 1024):
+        self.root_dir = root_dir
+        self.max_cache_bytes = max_cache_bytes
+        os.makedirs(root_dir, exist_ok=True)
+        self._connections = ConnectionManager(os.path.join(root_dir, "registry.db"))
+        # (system_name, kind) -> (version, frame, size in bytes), least recently used first
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.RLock()
+        self._connections.connection().execute("""
+        CREATE TABLE IF NOT EXISTS systems (
+            system_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            key_columns TEXT NOT NULL,
+            criteria_columns TEXT NOT NULL,
+            history_version INTEGER NOT NULL DEFAULT 0,
+            predictions_version INTEGER NOT NULL DEFAULT 0,
+            profile_version INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+        """)
+        # Columns added after the first release of the registry
+        existing = {row[1] for row in self._connections.connection().execute("PRAGMA table_info(systems)")}
+        # history_index: JSON of the columns the key index was built over, plus its base version
+        for column, declaration in (("history_base", "INTEGER NOT NULL DEFAULT 0"), ("date_column", "TEXT"),
+                                    ("history_index", "TEXT")):
+            if column not in existing:
+                self._connections.connection().execute(f"ALTER TABLE systems ADD COLUMN {column} {declaration}")
+        # Records scored from the live prediction queue, oldest first (record is the scored row as JSON)
+        self._connections.connection().execute("""
+        CREATE TABLE IF NOT EXISTS live_results (
+            result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            system_name TEXT,
+            anomaly TEXT,
+            anomaly_score REAL,
+            anomaly_reason TEXT,
+            record TEXT NOT NULL,
+            scored_at TEXT
+        )
+        """)
+        # Background prediction jobs (status is the job's JSON snapshot); their scored chunks
+        # are Parquet files under prediction_jobs/<job_id>/, so any worker can serve a poll
+        self._connections.connection().execute("""
+        CREATE TABLE IF NOT EXISTS prediction_jobs (
+            job_id TEXT PRIMARY KEY,
+            system_name TEXT,
+            state TEXT NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TEXT
+        )
+        """)
+        self._connections.connection().commit()
+
+    def register(self, name, key_columns, criteria_columns):
+        """Create a system, or update the columns of an existing one (its frames are kept)."""
+        conn = self._connections.connection()
+        conn.execute("""
+        INSERT INTO systems (name, key_columns, criteria_columns, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET key_columns=excluded.key_columns,
+            criteria_columns=excluded.criteria_columns, updated_at=excluded.updated_at
+        """, (name, json.dumps(split_columns(key_columns)), json.dumps(split_columns(criteria_columns)),
+              datetime.now().isoformat(timespec="seconds")))
+        conn.commit()
+
+    def __contains__(self, name):
+        return self._row(name) is not None
+
+    def list_systems(self):
+        """All registered systems with their key and criteria columns."""
+        cursor = self._connections.connection().execute(
+            "SELECT name, key_columns, criteria_columns FROM systems ORDER BY system_id"
+        )
+        return [
+            {"name": name, "key_columns": json.loads(keys), "criteria_columns": json.loads(criteria)}
+            for name, keys, criteria in cursor.fetchall()
+        ]
+
+    def info(self, name):
+        """Key and criteria columns of a system."""
+        row = self._require(name)
+        return {"key_columns": json.loads(row["key_columns"]), "criteria_columns": json.loads(row["criteria_columns"])}
+
+    def get_history(self, name):
+        return self._get_frame(name, "history")
+
+    def get_predictions(self, name):
+        return self._get_frame(name, "predictions")
+
+    def get_profile(self, name):
+        """Per-key history statistics of a system (see scoringUtil.history_profile)."""
+        info = self.info(name)
+        if not self._require(name)["profile_version"]:
+            return history_profile(self.get_history(name), info["key_columns"], info["criteria_columns"])
+        # Stored flat, kept indexed by key in the working set
+        return self._get_frame(name, "profile", lambda frame: frame.set_index(info["key_columns"]))
+
+    def put_history(self, name, history, date_column=None):
+        """
+        Replace a system's history (and its profile and key index).
+
+        :param date_column: As-of date column of the key index (detected from the usual history
+                            headers if omitted; without one the index is built by the next merge).
+        """
+        info = self.info(name)
+        profile = history_profile(history, info["key_columns"], info["criteria_columns"])
+        date_column = date_column or self._require(name)["date_column"] or find_date_column(history.columns)
+        index = spec = None
+        if date_column in history.columns:
+            spec = self._index_spec(info, date_column)
+            index = _history_index(history, info["key_columns"], date_column, info["criteria_columns"])
+        self._put_frame(name, "history", history, index=index, index_spec=spec)
+        self._put_frame(name, "profile", profile.reset_index(), resident=profile)
+
+    def merge_history(self, name, delta, mode="append", date_column=None):
+        """
+        Merge a history delta into a system's history, keyed on its key_columns plus the as-of date.
+
+        In "append" mode rows whose key and date are already in the history are ignored; in
+        "upsert" mode they replace the stored rows. Duplicates inside the delta keep the last row.
+        Stored rows are found through the key index, only the delta is written to disk and only
+        the touched keys' profile rows are recomputed, so the cost follows the delta's size.
+
+        :param delta: DataFrame of new history rows.
+        :param mode: "append" or "upsert".
+        :param date_column: As-of date column (detected from the usual history headers if omitted).
+        :return: Dictionary with rows_added, rows_updated, rows_ignored, keys_touched and history_rows.
+        """
+        if mode not in ("append", "upsert"):
+            raise ValueError(f"Unknown merge mode '{mode}'")
+        info = self.info(name)
+        key_columns = info["key_columns"]
+        date_column = date_column or find_date_column(delta.columns)
+        if date_column is None:
+            raise ValueError("No as-of date column found in the history file")
+        merge_columns = key_columns + [date_column]
+        missing = [col for col in merge_columns if col not in delta.columns]
+        if missing:
+            raise ValueError(f"History file is missing columns: {missing}")
+
+        delta = delta[~_row_keys(delta, merge_columns).duplicated(keep="last")]
+        self._set_date_column(name, date_column)
+        row = self._require(name)
+        if not row["history_version"]:
+            self.put_history(name, delta, date_column)
+            return {"rows_added": len(delta), "rows_updated": 0, "rows_ignored": 0,
+                    "keys_touched": int(_row_keys(delta, key_columns).nunique()), "history_rows": len(delta)}
+
+        spec = self._index_spec(info, date_column)
+        read_version = row["history_version"]
+        index = self._get_index(name, spec)
+        # Stored rows of the delta's keys, looked up in the key index (delta_index is row-aligned with delta)
+        delta = delta.reset_index(drop=True)
+        delta_index = _history_index(delta, key_columns, date_column, info["criteria_columns"], sort=False)
+        positions = _key_positions(index, delta_index["key_hash"].unique())
+        stored = _index_rows(index.iloc[positions])
+        incoming = _index_rows(delta_index)
+        overlap = incoming.isin(stored)
+        if mode == "append":
+            ignored, updated = int(overlap.sum()), 0
+            delta = delta[~overlap].reset_index(drop=True)
+            delta_index = delta_index[~overlap].reset_index(drop=True)
+            replaced = positions[:0]
+        else:
+            ignored, updated = 0, int(overlap.sum())
+            replaced = positions[stored.isin(incoming)]
+        if delta.empty:
+            return {"rows_added": 0, "rows_updated": 0, "rows_ignored": ignored, "keys_touched": 0,
+                    "history_rows": len(index)}
+
+        merged = _insert_index_rows(index, replaced, delta_index)
+        version = self._put_frame(name, "history", delta, part=True, index=delta_index, index_spec=spec)
+        if version != read_version + 1:
+            # Another process merged in between: continue from the published index
+            merged = self._get_index(name, spec)
+        else:
+            self._remember(name, "index", version, merged)
+        self._update_profile(name, merged, delta, delta_index, info)
+        if version - self._require(name)["history_base"] + 1 >= HISTORY_MAX_PARTS:
+            # Fold the parts back into one file
+            self._put_frame(name, "history", self.get_history(name), index=merged, index_spec=spec)
+        return {"rows_added": len(delta) - updated, "rows_updated": updated, "rows_ignored": ignored,
+                "keys_touched": int(delta_index["key_hash"].nunique()), "history_rows": len(merged)}
+
+    def _update_profile(self, name, index, delta, delta_index, info):
+        """Recompute the profile rows of the keys present in delta, from their rows in the key index."""
+        key_columns, criteria_columns = info["key_columns"], info["criteria_columns"]
+        touched = delta_index["key_hash"].unique()
+        rows = index.iloc[_key_positions(index, touched)]
+        # Key values of each touched hash, taken from the delta
+        keys = delta[key_columns].astype(str).set_axis(delta_index["key_hash"].to_numpy())
+        subset = pd.concat([
+            keys[~keys.index.duplicated()].loc[rows["key_hash"].to_numpy()].reset_index(drop=True),
+            rows[criteria_columns].reset_index(drop=True),
+        ], axis=1)
+        changed = history_profile(subset, key_columns, criteria_columns)
+        profile = self.get_profile(name)
+        profile = pd.concat([profile[~profile.index.isin(changed.index)], changed])
+        self._put_frame(name, "profile", profile.reset_index(), resident=profile)
+
+    @staticmethod
+    def _index_spec(info, date_column):
+        """Columns a key index is built over; an index built over other columns is rebuilt."""
+        return {"key_columns": info["key_columns"], "date_column": date_column,
+                "criteria_columns": info["criteria_columns"]}
+
+    def _get_index(self, name, spec):
+        """
+        Key index of the current history version, from the working set or disk.
+
+        A history written without an index (or indexed over other columns) is indexed once
+        from its full history and the index published for that version.
+        """
+        row = self._require(name)
+        version = row["history_version"]
+        stored = json.loads(row["history_index"]) if row["history_index"] else {}
+        base = stored.pop("base", None)
+        if base is not None and stored == spec:
+            with self._lock:
+                cached = self._cache.get((name, "index"))
+                if cached is not None and cached[0] == version:
+                    self._cache.move_to_end((name, "index"))
+                    return cached[1]
+            paths = [self._path(row, "index", v) for v in range(base, version + 1)]
+            if all(os.path.exists(path) for path in paths):
+                parts = [pd.read_parquet(path) for path in paths]
+                index = _stack_parts(parts, _index_rows).sort_values("key_hash", kind="stable", ignore_index=True)
+                self._remember(name, "index", version, index)
+                return index
+
+        index = _history_index(self.get_history(name), spec["key_columns"], spec["date_column"],
+                               spec["criteria_columns"])
+        path = self._path(row, "index", version)
+        index.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        conn = self._connections.connection()
+        conn.execute("UPDATE systems SET history_index = ? WHERE name = ? AND history_version = ?",
+                     (json.dumps({**spec, "base": version}), name, version))
+        conn.commit()
+        self._remember(name, "index", version, index)
+        return index
+
+    def _set_date_column(self, name, date_column):
+        conn = self._connections.connection()
+        conn.execute("UPDATE systems SET date_column = ? WHERE name = ?", (date_column, name))
+        conn.commit()
+
+    def put_predictions(self, name, predictions):
+        """Replace a system's latest predictions."""
+        self._put_frame(name, "predictions", predictions)
+
+    def append_live_results(self, name, scored):
+        """
+        Persist records scored from the live queue in one transaction.
+
+        :param name: System the records were pushed for (may be unregistered).
+        :param scored: DataFrame with the pushed fields plus Anomaly / Anomaly Score / Anomaly Reason.
+        """
+        if scored.empty:
+            return
+        records = scored.to_json(orient="records", lines=True, date_format="iso").splitlines()
+        scores = pd.to_numeric(scored["Anomaly Score"], errors="coerce").astype(object)
+        scores = scores.where(pd.notna(scores), None)
+        scored_at = datetime.now().isoformat(timespec="seconds")
+        conn = self._connections.connection()
+        conn.executemany(
+            "INSERT INTO live_results (system_name, anomaly, anomaly_score, anomaly_reason, record, scored_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            zip([name] * len(scored), scored["Anomaly"], scores, scored["Anomaly Reason"], records,
+                [scored_at] * len(scored))
+        )
+        conn.commit()
+
+    def live_results(self, limit=100):
+        """The most recent live-queue results, newest last."""
+        rows = self._connections.connection().execute(
+            "SELECT record FROM live_results ORDER BY result_id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [json.loads(record) for record, in reversed(rows)]
+
+    def save_prediction_job(self, status):
+        """
+        Persist the status snapshot of a background prediction job (see jobUtil.Job.status).
+
+        :param status: Dictionary with at least job_id and status, plus system_name.
+        """
+        conn = self._connections.connection()
+        conn.execute("""
+        INSERT INTO prediction_jobs (job_id, system_name, state, status, updated_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(job_id) DO UPDATE SET state=excluded.state, status=excluded.status, updated_at=excluded.updated_at
+        """, (status["job_id"], status.get("system_name"), status["status"], json.dumps(status),
+              datetime.now().isoformat(timespec="seconds")))
+        conn.commit()
+
+    def prediction_job(self, job_id):
+        """Last persisted status of a prediction job (None if unknown)."""
+        row = self._connections.connection().execute(
+            "SELECT status FROM prediction_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def append_prediction_chunk(self, job_id, first_row, frame):
+        """
+        Store a chunk of a job's scored rows.
+
+        :param first_row: Position of the chunk's first row in the job's output (orders the chunks).
+        """
+        path = os.path.join(self._job_dir(job_id), f"chunk-{first_row:012d}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    def prediction_job_results(self, job_id, offset=0):
+        """A job's scored rows stored so far, from row `offset` (chunks before it are not read)."""
+        job_dir = self._job_dir(job_id)
+        names = sorted(name for name in os.listdir(job_dir) if name.endswith(".parquet")) \
+            if os.path.isdir(job_dir) else []
+        chunks, first_row = [], 0
+        for name in names:
+            path = os.path.join(job_dir, name)
+            rows = pq.ParquetFile(path).metadata.num_rows
+            if first_row + rows > offset:
+                chunks.append(pd.read_parquet(path).iloc[max(offset - first_row, 0):])
+            first_row += rows
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def evict_prediction_jobs(self, retained):
+        """Delete the oldest finished jobs (status and rows) beyond `retained` jobs; running jobs are kept."""
+        conn = self._connections.connection()
+        total = conn.execute("SELECT COUNT(*) FROM prediction_jobs").fetchone()[0]
+        if total <= retained:
+            return
+        job_ids = [job_id for job_id, in conn.execute(
+            "SELECT job_id FROM prediction_jobs WHERE state IN ('completed', 'failed') ORDER BY rowid LIMIT ?",
+            (total - retained,)
+        )]
+        conn.executemany("DELETE FROM prediction_jobs WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+        conn.commit()
+        for job_id in job_ids:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.root_dir, "prediction_jobs", job_id)
+
+    def cache_stats(self):
+        """Frames resident in this process and their total size."""
+        with self._lock:
+            return {
+                "resident": [f"{name}/{kind}" for name, kind in self._cache],
+                "bytes": self._cache_bytes,
+                "max_bytes": self.max_cache_bytes,
+            }
+
+    def _row(self, name):
+        cursor = self._connections.connection().execute("SELECT * FROM systems WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        return dict(zip([desc[0] for desc in cursor.description], row)) if row else None
+
+    def _require(self, name):
+        row = self._row(name)
+        if row is None:
+            raise KeyError(f"System '{name}' is not registered")
+        return row
+
+    def _path(self, row, kind, version):
+        return os.path.join(self.root_dir, f"system_{row['system_id']}", f"{kind}-v{version}.parquet")
+
+    def _get_frame(self, name, kind, prepare=None):
+        """
+        Return a frame from the working set, loading it from disk if missing or outdated.
+
+        :param prepare: Optional transformation applied once after loading from disk.
+        """
+        row = self._require(name)
+        version = row[f"{kind}_version"]
+        with self._lock:
+            cached = self._cache.get((name, kind))
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end((name, kind))
+                return cached[1]
+        frame = self._read_frame(row, kind, version) if version else pd.DataFrame()
+        if prepare is not None and version:
+            frame = prepare(frame)
+        self._remember(name, kind, version, frame)
+        return frame
+
+    def _read_frame(self, row, kind, version):
+        """Read a frame version from disk: history is its last full write plus the parts appended since."""
+        if kind != "history" or not row["history_base"] or row["history_base"] == version:
+            return pd.read_parquet(self._path(row, kind, version))
+        parts = [pd.read_parquet(self._path(row, kind, v)) for v in range(row["history_base"], version + 1)]
+        if row["date_column"]:
+            # Rows upserted by a later part replace the matching rows of the earlier ones
+            merge_columns = json.loads(row["key_columns"]) + [row["date_column"]]
+            return _stack_parts(parts, lambda part: _row_keys(part, merge_columns))
+        return concat_frames(parts)
+
+    def _put_frame(self, name, kind, frame, resident=None, part=False, index=None, index_spec=None):
+        """
+        Write a new version of a frame, publish it, and drop versions no reader needs any more.
+
+        :param resident: Form of the frame to keep in the working set (defaults to the frame itself).
+        :param part: Store the frame as a history part on top of the current history instead of
+                     replacing it; the stacked history is then dropped from the working set.
+        :param index: Key index of a history frame (of just the part's rows for a part), written
+                      with the same version; without one the history is left unindexed.
+        :param index_spec: Columns the index was built over (see _index_spec).
+        :return: The published version.
+        """
+        row = self._require(name)
+        conn = self._connections.connection()
+        # BEGIN IMMEDIATE takes the write lock, so concurrent writers get distinct versions
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version, base, indexed = conn.execute(
+                f"SELECT {kind}_version, history_base, history_index FROM systems WHERE name = ?", (name,)
+            ).fetchone()
+            version += 1
+            path = self._path(row, kind, version)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            frame.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            conn.execute(
+                f"UPDATE systems SET {kind}_version = ?, updated_at = ? WHERE name = ?",
+                (version, datetime.now().isoformat(timespec="seconds"), name)
+            )
+            if kind == "history":
+                if index is not None:
+                    index_path = self._path(row, "index", version)
+                    index.to_parquet(index_path + ".tmp", index=False)
+                    os.replace(index_path + ".tmp", index_path)
+                if not part:
+                    conn.execute("UPDATE systems SET history_base = ? WHERE name = ?", (version, name))
+                stored = json.loads(indexed) if indexed else {}
+                stored.pop("base", None)
+                if index is None or (part and stored != index_spec):
+                    # A part extends the index only if the versions below it are indexed over the same columns
+                    indexed = None
+                elif not part:
+                    indexed = json.dumps({**index_spec, "base": version})
+                conn.execute("UPDATE systems SET history_index = ? WHERE name = ?", (indexed, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if part and resident is None:
+            self._forget(name, kind)
+        else:
+            self._remember(name, kind, version, frame if resident is None else resident)
+        if part:
+            return version
+        # Keep the previous version (all of its parts) for readers in other processes that have not switched yet
+        previous = (base or version - 1) if kind == "history" else version - 1
+        for stale in range(previous - 1, 0, -1):
+            stale_path = self._path(row, kind, stale)
+            if not os.path.exists(stale_path):
+                break
+            os.remove(stale_path)
+            if kind == "history" and os.path.exists(self._path(row, "index", stale)):
+                os.remove(self._path(row, "index", stale))
+        return version
+
+    def _forget(self, name, kind):
+        """Drop a frame from the working set."""
+        with self._lock:
+            previous = self._cache.pop((name, kind), None)
+            if previous is not None:
+                self._cache_bytes -= previous[2]
+
+    def _remember(self, name, kind, version, frame):
+        """Add a frame to the working set and evict least recently used frames beyond max_cache_bytes."""
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            self._forget(name, kind)
+            self._cache[(name, kind)] = (version, frame, size)
+            self._cache_bytes += size
+            while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+                _, (_, _, evicted) = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted
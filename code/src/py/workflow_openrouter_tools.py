@@ -1,12 +1,14 @@
 import json
 import os
-from openai import OpenAI
 from langgraph.graph import StateGraph, END
 from langchain.tools import tool
 from typing import Dict, Any, List
 import graphviz
 from pydantic import BaseModel
 from sqlUtil import SQLiteDB
+from historyStore import open_history_store
+from historyCache import history_cache
+from llmClient import LLMClient
 
 # ------------------ OpenRouter Configuration ------------------
 
@@ -18,13 +20,16 @@ GEMINE_API_KEY = config["gemini_api_key"]
 MISTRAL_API_KEY = config["mistral_key"]
 OPENAI_BASE_URL = config["base_url"]
 
-client = OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENAI_BASE_URL)
-gemini_client = OpenAI(api_key=GEMINE_API_KEY, base_url=OPENAI_BASE_URL)
-mistral_client = OpenAI(api_key=MISTRAL_API_KEY, base_url=OPENAI_BASE_URL)
+# One rate-limited, retrying client per API key (limits apply per key)
+client = LLMClient.from_config(config)
+gemini_client = LLMClient.from_config(config, api_key=GEMINE_API_KEY)
+mistral_client = LLMClient.from_config(config, api_key=MISTRAL_API_KEY)
 
-db = SQLiteDB()
-# Load historical data from a CSV file
-db.load_csv_data(config["historical_data_file"])
+db = SQLiteDB(config.get("history_db_path", ":memory:"), retention_months=config.get("history_retention_months"))
+# Append any history not yet in the store
+history_store = open_history_store(config, db)
+history_cache.resize(config.get("history_cache_size", history_cache.maxsize))
+history_store.load_csv_incremental(config["historical_data_file"])
 
 # ------------------ Define Tools for External APIs ------------------
 
@@ -132,7 +137,7 @@ graph.add_node("fetch_record", fetch_record)
 
 # Step 2: Fetch history data
 def fetch_history(state: WorkflowState) -> WorkflowState:
-    state.history_data = db.get_historical_data(state.record)
+    state.history_data = history_store.get_historical_data(state.record)
     return state
 
 
@@ -149,11 +154,7 @@ def detect_anomaly(state: WorkflowState) -> WorkflowState:
             new_data=json.dumps(state.record, indent=2)
         )
 
-    completion = client.chat.completions.create(
-    extra_headers={
-
-    },
-    extra_body={},
+    completion = client.complete(
     model=config["llm_model"],
     messages=[
             {"role": "system", "content": "You are a financial anomaly detection assistant."},
@@ -207,7 +208,7 @@ def decide_action(state: WorkflowState) -> WorkflowState:
 
     print(f"action Prompt: {prompt}")
 
-    response = mistral_client.chat.completions.create(
+    response = mistral_client.complete(
     model="mistralai/mistral-small-3.1-24b-instruct:free",
     messages=[
             {"role": "system", "content": "You are an AI agent responsible for deciding actions based on anomalies."},
@@ -235,7 +236,7 @@ def decide_action(state: WorkflowState) -> WorkflowState:
         prompt += f"\nAdditional data received: {json.dumps(additional_data, indent=2)}"
         ### Based on the above data, LLM will be invoked to decide the action ###
         ### Additionally RAG can be adopted to send the reconciler's feedback, back to LLM ###
-        response = client.chat.completions.create(
+        response = client.complete(
             model=config["llm_model"],
             messages=[
                 {"role": "system",
@@ -1,10 +1,32 @@
 from flask import Flask, render_template, request, redirect, url_for
+import gzip
 import pandas as pd
 from workflow import run_workflow
 from global_state import state
 
 app = Flask(__name__)
 
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+
+# Reconciliation key columns: read as text categoricals (keeps leading zeros like "00000", small and fast to group)
+KEY_COLUMN_DTYPES = {
+    col: "category" for col in ("Company", "Account", "AU", "Currency", "Primary Account", "Secondary Account")
+}
+
+@app.after_request
+def compress_response(response):
+    """Gzip large pages (LLM responses and predictions are rendered inline) when the client accepts it."""
+    if (response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers
+            or not request.accept_encodings["gzip"]):
+        return response
+    body = response.get_data()
+    if len(body) >= COMPRESS_MIN_SIZE:
+        response.set_data(gzip.compress(body, compresslevel=1))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
+
 @app.route("/", methods=["GET", "POST"])
 def upload_file():
     if request.method == "POST":
@@ -18,8 +40,8 @@ def upload_file():
             return "Please select both CSV files before submitting."
 
         # Read files into Pandas DataFrames (on-the-fly, no saving)
-        historical_df = pd.read_csv(historical_file)
-        realtime_df = pd.read_csv(realtime_file)
+        historical_df = pd.read_csv(historical_file, dtype=KEY_COLUMN_DTYPES)
+        realtime_df = pd.read_csv(realtime_file, dtype=KEY_COLUMN_DTYPES)
 
         # Trigger LangGraph workflow with both DataFrames
         results = run_workflow(historical_df, realtime_df)
@@ -1,3 +1,5 @@
+import random
+import time
 import requests
 
 # OpenRouter API URL
@@ -15,10 +17,25 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Per-request timeout (connect, read) in seconds, and retries with exponential backoff on 429/5xx
+REQUEST_TIMEOUT = (5, 60)
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+
+def _backoff(attempt, response=None):
+    """Seconds to wait before a retry: the server's Retry-After if given, else exponential with jitter."""
+    try:
+        return min(float(response.headers["Retry-After"]), BACKOFF_MAX_SECONDS)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return min(BACKOFF_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
 
 def query_openrouter(prompt, model=MODEL_NAME):
     """
     Sends a prompt to the OpenRouter API and returns the model's response.
+    Timeouts, connection errors, 429 and 5xx responses are retried with backoff.
     """
     payload = {
         "model": model,
@@ -28,7 +45,18 @@ def query_openrouter(prompt, model=MODEL_NAME):
         "max_tokens": 512
     }
 
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = requests.post(API_URL, headers=HEADERS, json=payload, timeout=REQUEST_TIMEOUT)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt == MAX_RETRIES:
+                return f"Error: {e}"
+            time.sleep(_backoff(attempt))
+            continue
+        if (response.status_code == 429 or response.status_code >= 500) and attempt < MAX_RETRIES:
+            time.sleep(_backoff(attempt, response))
+            continue
+        break
 
     if response.status_code == 200:
         return response.json()["choices"][0]["message"]["content"]
@@ -0,0 +1,40 @@
+import csv
+import os
+import sys
+
+import pytest
+
+# The application modules live in code/src/py and import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "py"))
+
+# Header of the IHub history extracts ("IHub - History.csv")
+HISTORY_HEADER = [
+    "As of Date", "Company", "Account", "AU", "Currency", "Primary Account", "Secondary Account",
+    "GL Balance", "Ihub Balance", "Balance Difference", "Match Status",
+]
+
+
+def history_key(account):
+    """Lookup record of one reconciliation key of the test extracts."""
+    return {"company_number": "00000", "account": account, "AU": "4398", "currency": "USD",
+            "primary_account": "ALL OTHER LOANS", "secondary_account": "DEFERRED COSTS"}
+
+
+def history_row(account, as_of_date, gl_balance, ihb_balance):
+    """One extract row; balances may be "" (blank cell), and the difference is blank with them."""
+    blank = "" in (gl_balance, ihb_balance)
+    return [as_of_date, "00000", account, "4398", "USD", "ALL OTHER LOANS", "DEFERRED COSTS",
+            gl_balance, ihb_balance, "" if blank else gl_balance - ihb_balance, "Match"]
+
+
+@pytest.fixture
+def write_history_csv(tmp_path):
+    """Write history rows to a CSV with the extract header; returns its path."""
+    def write(rows, name="history.csv"):
+        path = tmp_path / name
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(HISTORY_HEADER)
+            writer.writerows(rows)
+        return str(path)
+    return write
@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from conftest import history_key, history_row
+from parquetUtil import ParquetHistoryStore
+from sqlUtil import SQLiteDB
+
+ACCOUNTS = [str(1619200 + idx) for idx in range(5)]
+CHUNK_SIZE = 10
+
+
+class SQLiteBackend:
+    def __init__(self, tmp_path):
+        self.store = SQLiteDB(str(tmp_path / "history.db"))
+
+    def fail_on_chunk(self, monkeypatch, chunk_number):
+        """Make the chunk_number-th chunk of the next load fail before it is written."""
+        insert = self.store._insert_history
+        calls = []
+
+        def failing(data):
+            calls.append(1)
+            if len(calls) == chunk_number:
+                raise RuntimeError("disk full")
+            return insert(data)
+        monkeypatch.setattr(self.store, "_insert_history", failing)
+
+
+class ParquetBackend:
+    def __init__(self, tmp_path):
+        self.store = ParquetHistoryStore(str(tmp_path / "parquet"), "test")
+        # Arrow reads 4 MB blocks: split them so small files are also written in several parts
+        read = self.store._read_csv_batches
+
+        def batches(csv_filepath, chunk_size):
+            for table in read(csv_filepath, chunk_size):
+                for offset in range(0, len(table), chunk_size):
+                    yield table.slice(offset, chunk_size)
+        self.store._read_csv_batches = batches
+
+    def fail_on_chunk(self, monkeypatch, chunk_number):
+        write = self.store._write_part
+        calls = []
+
+        def failing(table):
+            calls.append(1)
+            if len(calls) == chunk_number:
+                raise RuntimeError("disk full")
+            return write(table)
+        monkeypatch.setattr(self.store, "_write_part", failing)
+
+
+@pytest.fixture(params=[SQLiteBackend, ParquetBackend], ids=["sqlite", "parquet"])
+def backend(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def newest_first(months, accounts=ACCOUNTS):
+    """Rows of every account with its newest month first, as in the IHub extracts."""
+    return [history_row(account, f"{month}/28/2024", 100 * month, 90 * month)
+            for account in accounts for month in sorted(months, reverse=True)]
+
+
+def stored_dates(store, account):
+    return [record["as_of_date"] for record in store.get_historical_data(history_key(account))]
+
+
+def touch(path):
+    """Give a rewritten file a new fingerprint even within the filesystem's timestamp resolution."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_first_load_of_a_newest_first_file_keeps_every_row(backend, write_history_csv):
+    path = write_history_csv(newest_first(range(1, 13)))
+
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 60
+    for account in ACCOUNTS:
+        assert stored_dates(backend.store, account) == [f"2024-{month:02d}-28" for month in range(1, 13)]
+
+
+def test_reload_appends_only_dates_after_the_watermark(backend, write_history_csv):
+    path = write_history_csv(newest_first(range(1, 7)))
+    backend.store.load_csv_incremental(path, CHUNK_SIZE)
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 0
+
+    # The next extract repeats the old months (one with a changed balance) and adds two new ones
+    rows = newest_first(range(1, 9))
+    rows[-1] = history_row(ACCOUNTS[-1], "1/28/2024", 1, 1)
+    write_history_csv(rows)
+    touch(path)
+
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 10
+    for account in ACCOUNTS:
+        assert stored_dates(backend.store, account) == [f"2024-{month:02d}-28" for month in range(1, 9)]
+    assert backend.store.get_historical_data(history_key(ACCOUNTS[-1]))[0]["gl_balance"] == 100
+
+
+def test_failed_load_resumes_without_duplicating_written_chunks(backend, write_history_csv, monkeypatch):
+    path = write_history_csv(newest_first(range(1, 13)))
+    backend.fail_on_chunk(monkeypatch, 3)
+    with pytest.raises(RuntimeError):
+        backend.store.load_csv_incremental(path, CHUNK_SIZE)
+    monkeypatch.undo()
+    written = sum(len(stored_dates(backend.store, account)) for account in ACCOUNTS)
+    assert written == 2 * CHUNK_SIZE
+
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 60 - written
+    for account in ACCOUNTS:
+        assert stored_dates(backend.store, account) == [f"2024-{month:02d}-28" for month in range(1, 13)]
+    # Completed: the file's fingerprint is recorded and the newest date is the watermark
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 0
+    write_history_csv(newest_first(range(1, 13)) + newest_first([12]))
+    touch(path)
+    assert backend.store.load_csv_incremental(path, CHUNK_SIZE) == 0
+
+
+def test_undated_file_appends_rows_after_the_last_loaded_one(backend, tmp_path):
+    path = tmp_path / "undated.csv"
+    lines = ["Company,Account,AU,Currency,Primary Account,Secondary Account,GL Balance,Ihub Balance"]
+    lines += [f"00000,{account},4398,USD,ALL OTHER LOANS,DEFERRED COSTS,{idx},{idx}"
+              for idx, account in enumerate(ACCOUNTS * 3)]
+    path.write_text("\n".join(lines) + "\n")
+    assert backend.store.load_csv_incremental(str(path), CHUNK_SIZE) == 15
+
+    path.write_text("\n".join(lines + [lines[1]]) + "\n")
+    touch(path)
+    assert backend.store.load_csv_incremental(str(path), CHUNK_SIZE) == 1
+    assert len(backend.store.get_historical_data(history_key(ACCOUNTS[0]))) == 4
@@ -0,0 +1,68 @@
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import history_key, history_row
+from sqlUtil import SQLiteDB, STATS_METRICS, STATS_RECENT_ROWS
+
+ACCOUNTS = [str(1619200 + idx) for idx in range(4)]
+
+
+def random_balance(rng):
+    return "" if rng.random() < 0.15 else round(rng.uniform(-1e6, 1e6), 2)
+
+
+@pytest.fixture
+def loaded(tmp_path, write_history_csv):
+    """A store loaded in small chunks from shuffled months with blank balances, plus the same rows as a frame."""
+    rng = random.Random(7)
+    rows = [history_row(account, f"{month}/{day}/{year}", random_balance(rng), random_balance(rng))
+            for account in ACCOUNTS for year in (2022, 2023) for month in range(1, 13) for day in (7, 21)]
+    rng.shuffle(rows)
+    db = SQLiteDB(str(tmp_path / "history.db"))
+    db.load_csv_data(write_history_csv(rows), chunk_size=7)
+
+    frame = pd.DataFrame(rows, columns=["as_of_date", "company", "account", "AU", "currency", "primary",
+                                        "secondary", "gl_balance", "ihb_balance", "difference", "status"])
+    frame["as_of_date"] = pd.to_datetime(frame["as_of_date"], format="%m/%d/%Y").dt.strftime("%Y-%m-%d")
+    for metric in STATS_METRICS:
+        frame[metric] = pd.to_numeric(frame[metric].replace("", None))
+    return db, frame
+
+
+def assert_matches_recompute(stats, history):
+    assert stats["count"] == len(history)
+    assert stats["last_as_of_date"] == history["as_of_date"].max()
+    for metric in STATS_METRICS:
+        values = history[metric].dropna()
+        assert stats[metric]["mean"] == pytest.approx(values.mean())
+        assert stats[metric]["std"] == pytest.approx(values.std(ddof=1))
+        assert stats[metric]["min"] == pytest.approx(values.min())
+        assert stats[metric]["max"] == pytest.approx(values.max())
+    recent = history.sort_values("as_of_date").tail(STATS_RECENT_ROWS)
+    assert [entry["as_of_date"] for entry in stats["recent"]] == list(recent["as_of_date"])
+    for metric in ("gl_balance", "ihb_balance", "difference"):
+        expected = [None if pd.isna(value) else pytest.approx(value) for value in recent[metric]]
+        assert [entry[metric] for entry in stats["recent"]] == expected
+
+
+def test_incremental_stats_match_a_full_recompute(loaded):
+    db, frame = loaded
+    for account in ACCOUNTS:
+        assert_matches_recompute(db.get_history_stats(history_key(account)), frame[frame["account"] == account])
+
+
+def test_rebuilt_stats_match_a_full_recompute(loaded):
+    db, frame = loaded
+    db.rebuild_history_stats(chunk_size=5)
+    summaries = db.get_history_stats_bulk([history_key(account) for account in ACCOUNTS])
+    assert len(summaries) == len(ACCOUNTS)
+    for account in ACCOUNTS:
+        key = tuple(history_key(account).values())
+        assert_matches_recompute(summaries[key], frame[frame["account"] == account])
+
+
+def test_key_without_history_has_no_stats(loaded):
+    db, _ = loaded
+    assert db.get_history_stats(history_key("9999999")) is None
@@ -0,0 +1,55 @@
+from conftest import history_key, history_row
+from sqlUtil import SQLiteDB
+
+OLD, NEW = "1619200", "1619201"
+
+
+def rollup_of(db, account, period):
+    return next(rollup for rollup in db.get_monthly_rollups(history_key(account)) if rollup["period"] == period)
+
+
+def test_rollups_merge_across_runs_and_ignore_blank_balances(tmp_path, write_history_csv):
+    db = SQLiteDB(str(tmp_path / "history.db"))
+    db.load_csv_data(write_history_csv([
+        history_row(OLD, "1/5/2023", 1, 0),
+        history_row(OLD, "1/10/2023", "", ""),
+        history_row(OLD, "1/15/2023", 3, 0),
+        history_row(NEW, "1/5/2023", "", ""),
+        history_row(NEW, "6/28/2024", 7, 7),
+    ]))
+    assert db.apply_retention(3) == 4
+    # Only the month outside the window was rolled up; its raw rows are gone
+    assert [record["as_of_date"] for record in db.get_historical_data(history_key(OLD))] == []
+    assert [record["as_of_date"] for record in db.get_historical_data(history_key(NEW))] == ["2024-06-28"]
+    assert rollup_of(db, NEW, "2023-01")["gl_balance"] == {"mean": None, "min": None, "max": None}
+
+    # A later extract back-fills the rolled-up month: the next run merges into the same rollup
+    db.load_csv_data(write_history_csv([
+        history_row(OLD, "1/25/2023", 5, 0),
+        history_row(NEW, "1/25/2023", 5, 0),
+    ], name="backfill.csv"))
+    assert db.apply_retention(3) == 2
+
+    merged = rollup_of(db, OLD, "2023-01")
+    assert merged["count"] == 4
+    assert merged["last_as_of_date"] == "2023-01-25"
+    assert merged["gl_balance"] == {"mean": 3, "min": 1, "max": 5}
+    assert merged["ihb_balance"] == {"mean": 0, "min": 0, "max": 0}
+
+    # The blank-only side must not null out the values merged into it
+    backfilled = rollup_of(db, NEW, "2023-01")
+    assert backfilled["count"] == 2
+    assert backfilled["gl_balance"] == {"mean": 5, "min": 5, "max": 5}
+    assert backfilled["difference"] == {"mean": 5, "min": 5, "max": 5}
+
+
+def test_retention_is_counted_from_the_newest_loaded_month(tmp_path, write_history_csv):
+    db = SQLiteDB(str(tmp_path / "history.db"))
+    db.load_csv_data(write_history_csv([history_row(OLD, f"{month}/28/2024", month, month) for month in range(1, 7)]))
+
+    assert db.apply_retention(6) == 0
+    assert db.apply_retention(2) == 4
+    assert db.apply_retention(2) == 0
+    assert [rollup["period"] for rollup in db.get_monthly_rollups(history_key(OLD))] == [
+        "2024-01", "2024-02", "2024-03", "2024-04"]
+    assert len(db.get_historical_data(history_key(OLD))) == 2
@@ -0,0 +1,99 @@
+import random
+
+import pandas as pd
+import pytest
+
+from scoringUtil import history_profile
+from systemRegistry import HISTORY_MAX_PARTS, SystemRegistry
+
+KEY_COLUMNS = ["Company", "Account"]
+CRITERIA_COLUMNS = ["GL Balance", "Ihub Balance"]
+MERGE_COLUMNS = KEY_COLUMNS + ["As of Date"]
+
+
+def random_delta(rng, rows):
+    """History rows over a small key and date space, so deltas overlap the stored history and each other."""
+    return pd.DataFrame({
+        "Company": [rng.choice(["00000", "00100"]) for _ in range(rows)],
+        "Account": [str(rng.randint(1619200, 1619209)) for _ in range(rows)],
+        "As of Date": [f"{rng.randint(1, 12)}/28/2024" for _ in range(rows)],
+        "GL Balance": [float(rng.randint(-1000, 1000)) for _ in range(rows)],
+        "Ihub Balance": [float(rng.randint(-1000, 1000)) if rng.random() > 0.1 else None for _ in range(rows)],
+    })
+
+
+def reference_merge(history, delta, mode):
+    """What merge_history should produce, computed on full frames."""
+    delta = delta.drop_duplicates(MERGE_COLUMNS, keep="last")
+    stored = pd.MultiIndex.from_frame(history[MERGE_COLUMNS])
+    incoming = pd.MultiIndex.from_frame(delta[MERGE_COLUMNS])
+    if mode == "append":
+        return pd.concat([history, delta[~incoming.isin(stored)]], ignore_index=True)
+    return pd.concat([history[~stored.isin(incoming)], delta], ignore_index=True)
+
+
+def assert_matches_reference(registry, reference):
+    history = registry.get_history("recon")[reference.columns]
+    history = history.astype({col: str for col in MERGE_COLUMNS})
+    pd.testing.assert_frame_equal(
+        history.sort_values(MERGE_COLUMNS, ignore_index=True),
+        reference.sort_values(MERGE_COLUMNS, ignore_index=True),
+        check_dtype=False,
+    )
+    profile = registry.get_profile("recon")
+    expected = history_profile(reference, KEY_COLUMNS, CRITERIA_COLUMNS)
+    pd.testing.assert_frame_equal(
+        profile[expected.columns].sort_index(), expected.sort_index(), check_dtype=False, check_names=False
+    )
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = SystemRegistry(str(tmp_path / "registry"))
+    registry.register("recon", KEY_COLUMNS, CRITERIA_COLUMNS)
+    return registry
+
+
+def test_append_ignores_and_upsert_replaces_stored_dates(registry):
+    first = pd.DataFrame({"Company": ["00000", "00000"], "Account": ["1619200", "1619200"],
+                          "As of Date": ["1/28/2024", "2/28/2024"], "GL Balance": [1.0, 2.0],
+                          "Ihub Balance": [1.0, 2.0]})
+    registry.merge_history("recon", first)
+    delta = first.assign(**{"GL Balance": [10.0, 20.0]}).iloc[[1]]
+    delta = pd.concat([delta, first.assign(**{"As of Date": "3/28/2024", "GL Balance": 3.0}).iloc[[0]]])
+
+    assert registry.merge_history("recon", delta, mode="append") == {
+        "rows_added": 1, "rows_updated": 0, "rows_ignored": 1, "keys_touched": 1, "history_rows": 3}
+    assert registry.merge_history("recon", delta, mode="upsert") == {
+        "rows_added": 0, "rows_updated": 2, "rows_ignored": 0, "keys_touched": 1, "history_rows": 3}
+    assert sorted(registry.get_history("recon")["GL Balance"]) == [1.0, 3.0, 20.0]
+    assert registry.get_profile("recon")["GL Balance mean"].iloc[0] == pytest.approx(8.0)
+
+
+def test_merges_match_a_full_recompute_across_compaction_and_reopen(registry, tmp_path):
+    rng = random.Random(11)
+    reference = random_delta(rng, 40).drop_duplicates(MERGE_COLUMNS, keep="last")
+    registry.put_history("recon", reference)
+
+    for step in range(2 * HISTORY_MAX_PARTS):
+        mode = "append" if step % 3 else "upsert"
+        delta = random_delta(rng, rng.randint(1, 15))
+        expected = reference_merge(reference, delta, mode)
+        result = registry.merge_history("recon", delta, mode=mode)
+        assert result["history_rows"] == len(expected)
+        reference = expected
+        assert_matches_reference(registry, reference)
+
+    # A new process reads the published parts and index back from disk
+    reopened = SystemRegistry(registry.root_dir)
+    assert_matches_reference(reopened, reference)
+
+    # Without a published index the next merge rebuilds it from the full history
+    conn = reopened._connections.connection()
+    conn.execute("UPDATE systems SET history_index = NULL WHERE name = 'recon'")
+    conn.commit()
+    rebuilt = SystemRegistry(registry.root_dir)
+    delta = random_delta(rng, 20)
+    reference = reference_merge(reference, delta, "upsert")
+    assert rebuilt.merge_history("recon", delta, mode="upsert")["history_rows"] == len(reference)
+    assert_matches_reference(rebuilt, reference)